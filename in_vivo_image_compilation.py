@@ -5,17 +5,39 @@ Created by Brandon Anderson
 --- Script organization ---
 ---------------------------
 1. Imports
+	pandas, cv2 and tkinter are only imported when first used (pandas and cv2 in the background once the dialog box is open),
+	so the module can be imported by other tools quickly and without opening anything
 2. Settings dialog box
 	Uses tkinter dialog box to have the user imput how they want the compilation document to be organized
 	Each dialog box line (or group of lines) is divided into separate classes:
 		...
-3. find_oct_retina_bounds function
+3. Settings files
+	Reading/writing the settings dictionary from/to JSON or YAML files (used for batch mode)
+4. ImageCatalog and DirectoryScan classes
+	Listing of the image files in each directory, kept on disk so unchanged folders aren't listed again,
+	and the mice/image counts of each directory worked out once and shared by everything that needs them
+5. Reading lab IDs from cSLO images
+	OCR of the cSLO image footers (batched, with the text kept on disk so images are only read once)
+6. find_oct_retina_bounds function
 	Function that is used by both the user_defined_settings and ImageCompilation class
-4. ImageCompilation class
+	Also reading OCT images: memory-mapped TIFFs, and one B-scan of multi-frame volumes
+	(settings['oct_volume_frames'], e.g. {"volume": "max_signal"}, picks the frame for each image type)
+7. Streaming file writers
+	Writing the compilation document a strip at a time, as a PNG or as a deep zoom tile pyramid
+8. ImageCompilation class
 	Takes the user's settings and processes them into a compilation document, divided into functions:
 		...
-5. Main code orchestration
+9. Main code orchestration
 	The code the calls the user_defined_settings function and ImageCompilation class
+	Batch mode: python in_vivo_image_compilation.py study_1.json study_2.yaml ...
+		Compiles each settings file without the dialog box and without opening the result
+		[select] images use the choices saved in <name>.selections.json by earlier runs (if the candidates haven't changed)
+		--strips writes a PNG one strip of mice at a time, for studies too big to hold in memory
+		--deep-zoom writes a tile pyramid with an HTML page that pans and zooms through huge compilations
+		--pages group|N splits the document into pages (done automatically when it is too big for a JPEG)
+		--export-plan only saves the layout as JSON (rectangles, source images and their crop/resize steps), one file per page
+	python in_vivo_image_compilation.py --compare-retina-bounds OCT_DIRECTORY [--column-step N]
+		Checks the fast retina bounds detection against the original one on real scans
 	
 """
 
@@ -34,37 +56,118 @@ def status(msg):
     print("\rStatus: " + msg + " " * pad, end="", flush=True)
     _last_len = len(msg)
 
-status("Importing packages")
-import tkinter as tk
-from tkinter import filedialog
-from tkinter import ttk
-from tkinter import messagebox
 from datetime import datetime
 from dataclasses import dataclass, field
 from typing import Optional, Tuple, Literal, ClassVar
 import re
 import math
 import os
-import pandas as pd
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import importlib
+import contextlib
+import queue
+import itertools
+import collections
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
 import numpy as np
-import cv2
-from PIL import Image, ImageDraw, ImageFont, ImageTk, UnidentifiedImageError
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
 import warnings
 warnings.filterwarnings("ignore", message=".*pin_memory.*")
 import subprocess
-status("Package import complete")
+
+
+class LazyModule:
+	"""Stands in for a module that is only imported the first time one of its attributes is used."""
+	def __init__(self, module_name):
+		self.module_name = module_name
+		self.module = None
+		self.lock = threading.Lock()
+
+	def load(self):
+		with self.lock:
+			if self.module is None:
+				self.module = importlib.import_module(self.module_name)
+		return self.module
+
+	def __getattr__(self, name):
+		return getattr(self.load(), name)
+
+# pandas is only needed by the settings dialog box and cv2 by the image processing, and both take a while to import
+pd = LazyModule("pandas")
+cv2 = LazyModule("cv2")
+
+# tkinter is only needed for the windows, so batch mode also works where it isn't installed (e.g. on a render server)
+tk = LazyModule("tkinter")
+ttk = LazyModule("tkinter.ttk")
+filedialog = LazyModule("tkinter.filedialog")
+messagebox = LazyModule("tkinter.messagebox")
+ImageTk = LazyModule("PIL.ImageTk")
+
+def import_packages_in_background(*lazy_modules):
+	"""Import lazily loaded packages on a background thread, so they are ready by the time they are used."""
+	def import_packages():
+		for lazy_module in lazy_modules:
+			try:
+				lazy_module.load()
+			except ImportError:		# Raised again when the package is used
+				pass
+	threading.Thread(target=import_packages, daemon=True).start()
+
 def get_reader():
 	"""Return a persistent EasyOCR reader, loading it only once."""
-	if not hasattr(get_reader, "reader"):
-		status("Loading EasyOCR")
-		import easyocr
-		get_reader.reader = easyocr.Reader(['en'], verbose=False, gpu=False)
-		status("EasyOCR is loaded")
+	with get_reader.lock:	# The reader may be loading on the warm up thread already
+		if not hasattr(get_reader, "reader"):
+			status("Loading EasyOCR")
+			import easyocr
+			get_reader.reader = easyocr.Reader(['en'], verbose=False, gpu=False)
+			status("EasyOCR is loaded")
 	return get_reader.reader
+get_reader.lock = threading.Lock()
+
+# Start loading EasyOCR in the background as soon as a cSLO directory is chosen (it takes several seconds),
+# if "EasyOCR only" is selected (template matching reads most footers without it).
+# Only the default, it can be changed in the dialog box next to the OCR engine
+warm_up_ocr_reader = True
+
+# Engines that can read the lab IDs in the cSLO image footers (see read_cslo_footer_texts)
+ocr_engines = {"template": "OCR: template matching", "easyocr": "OCR: EasyOCR only"}
+default_ocr_engine = "template"
+
+def warm_up_reader():
+	"""Load the EasyOCR reader on a background thread, so it is ready when the lab IDs are read."""
+	if hasattr(get_reader, "reader") or getattr(warm_up_reader, "started", False):
+		return
+	warm_up_reader.started = True
+
+	def load_reader():
+		try:
+			get_reader()
+		except Exception as error:	# e.g. easyocr isn't installed, the error is shown when the lab IDs are read
+			print(f"\nEasyOCR could not be loaded in the background: {error!r}")
+	threading.Thread(target=load_reader, daemon=True).start()
 
 # Allowed image extensions
 image_extensions = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp"}
 
+# Where image catalogs and other caches are stored between launches
+cache_directory = os.path.join(os.path.expanduser("~"), ".cache", "in_vivo_image_compilation")
+
+# Largest width/height a JPEG can have (bigger compilations are split into pages)
+jpeg_size_limit = 65535
+
+# Which B-scan of a multi-frame OCT volume (TIFF) to use, unless settings['oct_volume_frames'] gives a rule for that image type:
+# "center", a frame number (counting from 0), or "max_signal" (the frame with the most retinal signal)
+default_oct_volume_frame = "center"
+oct_volume_frame_rules = {"center": "Center B-scan", "max_signal": "B-scan with the most signal"}	# The rules in the dialog box
+
 
 
 """
@@ -99,16 +202,27 @@ Bugs:
 ---------------------------
 """
 
+class AnalysisCancelled(Exception):
+	"""Raised inside a background directory analysis when its result is no longer needed."""
+
+
 def user_defined_settings():
 	def on_close_window():
 		root.destroy()
 		exit()
 
 	class DirectoryFrame(tk.Frame):
+		analysis_delay_ms = 400		# Wait until typing pauses before analysing the directories
+
 		def __init__(self, parent):
 			super().__init__(parent)
 			self.rows = []
 
+			# Directory analysis runs on a worker thread, results come back through analysis_results
+			self.pending_analysis = None		# after() id of the debounced analysis
+			self.analysis_generation = 0		# Increased on every change, so older (stale) analyses stop
+			self.analysis_results = queue.Queue()
+
 			# Add the first row initially
 			self.add_row()
 
@@ -171,9 +285,7 @@ def user_defined_settings():
 				row['cslo_cb'].grid(row=i, column=3, padx=5, pady=0)
 				row['oct_cb'].grid(row=i, column=4, padx=5, pady=0)
 
-			# Update the number of mice
-			number_of_mice_frame.mice_set.clear()
-			number_of_mice_frame.figure_out_how_many_mice()
+			# The number of mice is updated by the directory analysis that follows every change
 
 
 
@@ -186,7 +298,7 @@ def user_defined_settings():
 				row['cslo_var'].set(False)
 
 
-		def on_entry_change(self, event):
+		def on_entry_change(self, event, delay_ms=None):
 			entry_widget = event.widget
 			row_index = next(i for i, r in enumerate(self.rows) if r['entry'] == entry_widget)
 
@@ -197,68 +309,136 @@ def user_defined_settings():
 			# Remove extra empty rows
 			self.cleanup_empty_rows()
 
-			def check_directory(directory):
-				cslo_or_oct_directory = ""
-
-				# List contents of the directory
-				contents = os.listdir(directory)
-
-				# Filter out directories and files
-				subdirs = [os.path.join(directory, d) for d in contents if os.path.isdir(os.path.join(directory, d))]
-				files = [f for f in contents if os.path.isfile(os.path.join(directory, f))]
-
-				# cSLO images: Check if each subdir contains "OS" and "OD"
-				if subdirs:
-					valid = True
-					for subdir in subdirs:
-						if not (os.path.isdir(os.path.join(subdir, "OS")) or os.path.isdir(os.path.join(subdir, "OD"))):
-							valid = False
-							break
-					if valid:
-						cslo_or_oct_directory = "cslo"
-						return cslo_or_oct_directory
-
-				# OCT images: Check if the directory contains image files
-				# Get all files in directory (ignores subdirectories themselves)
-				files = [f for f in os.listdir(inputted_directory) 
-						if os.path.isfile(os.path.join(inputted_directory, f))]
-
-				# Look for image files with "_OD_" or "_OS_" in the filename
-				for f in files:
-					ext = os.path.splitext(f)[1].lower()
-					if ext in image_extensions and ("_OD_" in f or "_OS_" in f):
-						cslo_or_oct_directory = "oct"
-						return cslo_or_oct_directory
-
-				return cslo_or_oct_directory
+			# Analyse the directories once typing pauses (on a worker thread so the window doesn't freeze)
+			self.schedule_directory_analysis(entry_widget, delay_ms)
 
+		@staticmethod
+		def check_directory(directory):
+			"""Return "cslo" or "oct" depending on how the images in the directory are organized ("" if neither)."""
+			cslo_or_oct_directory = ""
+			catalog = ImageCatalog.for_directory(directory)
+
+			# List the subdirectories of the directory
+			subdirs = [os.path.join(directory, d) for d in catalog.subdirs(directory)]
+
+			# cSLO images: Check if each subdir contains "OS" and "OD"
+			if subdirs:
+				valid = True
+				for subdir in subdirs:
+					subdir_subdirs = catalog.subdirs(subdir)
+					if not ("OS" in subdir_subdirs or "OD" in subdir_subdirs):
+						valid = False
+						break
+				if valid:
+					cslo_or_oct_directory = "cslo"
+					return cslo_or_oct_directory
+
+			# OCT images: Check if the directory contains image files
+			# Look for image files with "_OD_" or "_OS_" in the filename (the catalog only holds image files)
+			for f in catalog.files(directory):
+				if "_OD_" in f or "_OS_" in f:
+					cslo_or_oct_directory = "oct"
+					return cslo_or_oct_directory
+
+			return cslo_or_oct_directory
+
+		# -- Directory analysis --
+		def schedule_directory_analysis(self, entry_widget, delay_ms=None):
+			if delay_ms is None:
+				delay_ms = self.analysis_delay_ms
+
+			# Restart the wait and stop any analysis of the previous path
+			if self.pending_analysis is not None:
+				self.after_cancel(self.pending_analysis)
+			self.analysis_generation += 1
+			self.pending_analysis = self.after(delay_ms, lambda: self.start_directory_analysis(entry_widget))
+
+		def start_directory_analysis(self, entry_widget):
+			self.pending_analysis = None
+			generation = self.analysis_generation
+
+			# Copy everything needed from the widgets, the worker thread must not touch tkinter
 			inputted_directory = entry_widget.get()
-			if os.path.exists(inputted_directory):
-				# Change the text color to black
-				entry_widget.config(fg="black")
+			rows = []
+			for row in self.rows:
+				if row['cslo_var'].get():
+					image_type = "cslo"
+				elif row['oct_var'].get():
+					image_type = "oct"
+				else:
+					image_type = None
+				rows.append((row['entry'], row['entry'].get().strip(), image_type))
 
-				# Determine if the images are cSLO or OCT and update the checkbox accordingly
-				cslo_or_oct_directory = check_directory(inputted_directory)
-				
-				if cslo_or_oct_directory == "cslo":
-					row = next(r for r in self.rows if r['entry'] == entry_widget)
+			def check_if_cancelled():
+				if generation != self.analysis_generation:
+					raise AnalysisCancelled()
+
+			def analyse_directories():
+				try:
+					result = {"directory_exists": os.path.exists(inputted_directory), "cslo_or_oct_directory": ""}
+
+					# Determine if the images are cSLO or OCT
+					if result["directory_exists"]:
+						result["cslo_or_oct_directory"] = self.check_directory(inputted_directory)
+
+					# Same as get_data(), but with the image type that was just found for the changed row
+					directories = []
+					for row_entry, path, image_type in rows:
+						check_if_cancelled()
+						if row_entry == entry_widget and result["cslo_or_oct_directory"]:
+							image_type = result["cslo_or_oct_directory"]
+						if path and os.path.exists(path):
+							directories.append((path, image_type))
+
+							# Scanning the changed directory again, the other directories' scans are reused
+							if row_entry == entry_widget:
+								DirectoryScan.for_directory(path, image_type, rescan=True, check_if_cancelled=check_if_cancelled)
+
+					# Mice and the availabe images the user can select (e.g. "BAF", "OCT vertical", etc.)
+					result["mice_set"] = number_of_mice_frame.find_mice(directories, check_if_cancelled)
+					result["available_image_types"] = images_to_use_frame.find_available_image_types(directories, check_if_cancelled)
+				except AnalysisCancelled:
+					return
+				except OSError as error:	# e.g. the directory was removed or the share disconnected mid-scan
+					print(f"\nCould not analyse {inputted_directory}: {error}")
+					return
+				self.analysis_results.put((generation, entry_widget, result))
+
+			analysis_thread = threading.Thread(target=analyse_directories, daemon=True)
+			analysis_thread.start()
+			self.after(50, lambda: self.check_for_analysis_results(analysis_thread))
+
+		def check_for_analysis_results(self, analysis_thread):
+			# Checked through after() so the widgets are only ever updated from the tkinter thread
+			while not self.analysis_results.empty():
+				generation, entry_widget, result = self.analysis_results.get()
+				if generation == self.analysis_generation:	# Skip results for a path that has been changed since
+					self.apply_directory_analysis(entry_widget, result)
+
+			if analysis_thread.is_alive():
+				self.after(50, lambda: self.check_for_analysis_results(analysis_thread))
+
+		def apply_directory_analysis(self, entry_widget, result):
+			row = next((r for r in self.rows if r['entry'] == entry_widget), None)
+			if row is not None:
+				# If this isn't a directory that exists, change the color to red
+				entry_widget.config(fg="black" if result["directory_exists"] else "red")
+
+				# Update the checkboxes if the images are cSLO or OCT
+				if result["cslo_or_oct_directory"] == "cslo":
 					row['cslo_var'].set(True)
 					row['oct_var'].set(False)
-				elif cslo_or_oct_directory == "oct":
-					row = next(r for r in self.rows if r['entry'] == entry_widget)
+					if mouse_info_frame.warm_up_ocr_var.get() and mouse_info_frame.selected_ocr_engine() == "easyocr":
+						warm_up_reader()	# Lab IDs will most likely be read from these images
+				elif result["cslo_or_oct_directory"] == "oct":
 					row['oct_var'].set(True)
 					row['cslo_var'].set(False)
 
-				# Update the number of mice
-				number_of_mice_frame.figure_out_how_many_mice()
-
-				# Update the availabe images the user can select (e.g. "BAF", "OCT vertical", etc.)
-				images_to_use_frame.determine_what_images_are_available()
-			
+			# Update the number of mice
+			number_of_mice_frame.set_mice(result["mice_set"])
 
-			# If this isn't a directory that exists, change the color to red
-			else:
-				entry_widget.config(fg="red")
+			# Update the availabe images the user can select
+			images_to_use_frame.set_available_image_types(result["available_image_types"])
 
 		def choose_directory(self, row_index=None, entry_widget=None):
 			directory = filedialog.askdirectory()
@@ -271,7 +451,7 @@ def user_defined_settings():
 				
 				row['entry'].delete(0, tk.END)
 				row['entry'].insert(0, directory)
-				self.on_entry_change(event=type('Event', (), {'widget': row['entry']})())
+				self.on_entry_change(event=type('Event', (), {'widget': row['entry']})(), delay_ms=0)
 
 		def get_data(self):
 			directories = []
@@ -304,38 +484,23 @@ def user_defined_settings():
 
 
 		def figure_out_how_many_mice(self):
-			self.mice_set.clear()
-
 			directory_info_from_user = directory_frame.get_data().get("directories")
-			
-			for entry in directory_info_from_user:
-				directory_path, image_type = entry
+			self.set_mice(self.find_mice(directory_info_from_user))
 
-				if image_type == "oct":
-					
-					for file in os.listdir(directory_path):
-						ext = os.path.splitext(file)[1].lower()
-						if ext in image_extensions:
-							mouse_number = file.split("_")[0]
-							self.mice_set.add(mouse_number)
-					
-				elif image_type == "cslo":
-					for item in os.listdir(directory_path):
-						subfolder_path = os.path.join(directory_path, item)
-						
-						# Check if it is a directory
-						if os.path.isdir(subfolder_path):
-							# Get a list of items inside this subfolder
-							sub_items = os.listdir(subfolder_path)
-							
-							# Check if both "OD" and "OS" exist as folders
-							if "OD" in sub_items and "OS" in sub_items:
-								od_path = os.path.join(subfolder_path, "OD")
-								os_path = os.path.join(subfolder_path, "OS")
-								
-								# Make sure both are directories, not files
-								if os.path.isdir(od_path) and os.path.isdir(os_path):
-									self.mice_set.add(item)
+		@staticmethod
+		def find_mice(directory_info_from_user, check_if_cancelled=None):
+			"""Return the set of mouse numbers in the directories. Doesn't touch any widgets (can run on a worker thread)."""
+			mice_set = set()
+
+			for directory_path, image_type in directory_info_from_user:
+				scan = DirectoryScan.for_directory(directory_path, image_type, check_if_cancelled=check_if_cancelled)
+				mice_set.update(scan.mice)
+
+			return mice_set
+
+		def set_mice(self, mice_set):
+			self.mice_set.clear()
+			self.mice_set.update(mice_set)
 		
 			number_of_mice = len(self.mice_set)
 			self.update_mouse_number(number_of_mice)
@@ -358,25 +523,58 @@ def user_defined_settings():
 		def __init__(self, parent):
 			super().__init__(parent)
 
-			self.df = pd.DataFrame(columns=[
-				"cSLO number",
-				"Lab ID",
-				"Group",
-				"Exclude images"
-			])
+			self._df = None		# Made when first used, so pandas doesn't need to be imported before the window appears
 			self.group_order = []
 
 			edit_button = tk.Button(self, text="Edit mouse info", command=self.edit_mouse_info)
 			edit_button.grid(row=0, column=0, padx=5)
 
-			cslo_labID_button = tk.Button(self, text="Determine lab ID from cSLO images",
+			self.cslo_labID_button = tk.Button(self, text="Determine lab ID from cSLO images",
 								  command=self.determine_cslo_labID_number)
-			cslo_labID_button.grid(row=0, column=1, padx=5)
+			self.cslo_labID_button.grid(row=0, column=1, padx=5)
+			self.labID_results = queue.Queue()	# Progress and results of the lab ID worker thread
+
+			# Template matching learns the footer font from EasyOCR reads, and leaves anything it isn't sure of to EasyOCR
+			self.ocr_engine_var = tk.StringVar(value=ocr_engines[default_ocr_engine])
+			self.ocr_engine_var.trace_add("write", self.on_ocr_engine_change)
+			ocr_engine_menu = tk.OptionMenu(self, self.ocr_engine_var, *ocr_engines.values())
+			ocr_engine_menu.grid(row=0, column=3, padx=5)
+
+			# Loading EasyOCR takes several seconds (and a lot of memory), so it can be left until the lab IDs are read
+			self.warm_up_ocr_var = tk.BooleanVar(value=warm_up_ocr_reader)
+			self.warm_up_ocr_var.trace_add("write", self.on_ocr_engine_change)
+			warm_up_ocr_checkbox = tk.Checkbutton(self, text="Load EasyOCR early", variable=self.warm_up_ocr_var)
+			warm_up_ocr_checkbox.grid(row=0, column=4, padx=5)
 
 			group_order_button = tk.Button(self, text="Group order", command=self.edit_group_order)
 			group_order_button.grid(row=0, column=2, padx=5)
 
 
+
+		@property
+		def df(self):
+			if self._df is None:
+				self._df = pd.DataFrame(columns=[
+					"cSLO number",
+					"Lab ID",
+					"Group",
+					"Exclude images"
+				])
+			return self._df
+
+		@df.setter
+		def df(self, df):
+			self._df = df
+
+		def selected_ocr_engine(self):
+			return next(engine for engine, name in ocr_engines.items() if name == self.ocr_engine_var.get())
+
+		def on_ocr_engine_change(self, *args):
+			# Switching to EasyOCR (or ticking "Load EasyOCR early") with a cSLO directory already chosen starts loading it
+			if self.warm_up_ocr_var.get() and self.selected_ocr_engine() == "easyocr":
+				if any(row['cslo_var'].get() for row in directory_frame.rows):
+					warm_up_reader()
+
 		def on_entry_change(self, *args):
 			self.sync_mice_with_df()
 
@@ -522,49 +720,26 @@ def user_defined_settings():
 			label.pack(side="left", padx=10)
 
 
-		def determine_labID_in_cslo_images(self, base_directory):
-			reader = get_reader()
+		@staticmethod
+		def determine_labID_in_cslo_images(base_directory, progress_callback=None, ocr_engine=default_ocr_engine):
 			cslo_ear_tag_dic = {}
 
-			# loop through all subfolders
-			for folder in os.listdir(base_directory):
-				folder_path = os.path.join(base_directory, folder)
-				if not os.path.isdir(folder_path):
-					continue  # skip non-folders
+			# first image of each mouse folder, preferring "OD" and falling back to "OS"
+			scan = DirectoryScan.for_directory(base_directory, "cslo")
+			first_image_paths = {}
+			for folder in scan.cslo_image_paths:
+				first_image_path = scan.first_cslo_image_path(folder)
+				if first_image_path is not None:	# skip if no images
+					first_image_paths[folder] = first_image_path
 
-				# prefer "OD", fallback to "OS"
-				target_dir = os.path.join(folder_path, "OD")
-				if not os.path.exists(target_dir):
-					target_dir = os.path.join(folder_path, "OS")
-				if not os.path.exists(target_dir):
-					continue # skip if it doesn't have the OD or OS subfolders
+			# OCR of all the footers at once
+			footer_texts = read_cslo_footer_texts(list(first_image_paths.values()), progress_callback, ocr_engine)
 
-				# find first image file in target_dir
-				files = [f for f in os.listdir(target_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.tif'))]
-				if not files:
-					continue	# skip if no images
-
-				first_image_path = os.path.join(target_dir, files[0])
-				img = cv2.imread(first_image_path)
-
-				if img is None:
+			for folder, first_image_path in first_image_paths.items():
+				if first_image_path not in footer_texts:
 					continue	# skip if can't read image
 
-				height, width, _ = img.shape
-
-				# crop bottom-left region
-				top_square_height = width
-				bottom_rect_height = height - top_square_height
-				crop_height = (bottom_rect_height // 3) + 10
-				crop_width = int(width * 0.70)  # left 70% of image
-
-				# slice: rows (y), columns (x)
-				cropped = img[top_square_height : top_square_height + crop_height, 0:crop_width]
-
-				# OCR
-				results = reader.readtext(cropped)
-				mouse_id = [res[1] for res in results]  # res[1] contains detected text
-				mouse_id_string = " ".join(mouse_id)
+				mouse_id_string = footer_texts[first_image_path]
 				if folder in mouse_id_string:
 					ear_tag_number = mouse_id_string.split(folder, 1)[1]
 				else:
@@ -592,18 +767,76 @@ def user_defined_settings():
 				print("No cSLO directories found")
 				return
 			
-			# Going through the cSLO image directories and grabbing the information from the images and putting it in the df
-			for directory in cslo_directories:
-				self.cslo_ear_tag_dic = self.determine_labID_in_cslo_images(directory)
-				for cslo_num, et_value in self.cslo_ear_tag_dic.items():
-					# check if the cSLO number exists in the df
-					if cslo_num in self.df["cSLO number"].values:
-						# update the Lab ID
-						self.df.loc[self.df["cSLO number"] == cslo_num, "Lab ID"] = et_value
-					else:
-						# add a new row
-						new_row = {"cSLO number": cslo_num, "Lab ID": et_value}
-						self.df = pd.concat([self.df, pd.DataFrame([new_row])], ignore_index=True)
+			# Reading the images on a worker thread, so the dialog box keeps responding
+			self.cslo_labID_button.config(state="disabled")
+			self.progress_window = tk.Toplevel(root)
+			self.progress_window.title("Determining lab IDs")
+			self.progress_window.transient(root)
+			self.progress_window.protocol("WM_DELETE_WINDOW", lambda: None)	# Closes by itself when the lab IDs are read
+			self.progress_label = tk.Label(self.progress_window, text="Reading images...")
+			self.progress_label.pack(padx=10, pady=(10, 5))
+			self.progress_bar = ttk.Progressbar(self.progress_window, length=300, mode="indeterminate")
+			self.progress_bar.pack(padx=10, pady=(0, 10))
+			self.progress_bar.start(15)
+
+			ocr_engine = self.selected_ocr_engine()
+			labID_thread = threading.Thread(
+				target=self.read_labIDs_in_background,
+				args=(cslo_directories, ocr_engine),
+				daemon=True
+			)
+			labID_thread.start()
+			self.after(50, self.check_for_labID_results)
+
+		def read_labIDs_in_background(self, cslo_directories, ocr_engine):
+			# Runs on the worker thread: nothing in here touches the widgets or the df
+			try:
+				cslo_ear_tag_dic = {}
+				for directory_number, directory in enumerate(cslo_directories, start=1):
+					def progress_callback(number_done, total):
+						self.labID_results.put(("progress", (directory_number, len(cslo_directories), number_done, total)))
+					cslo_ear_tag_dic.update(self.determine_labID_in_cslo_images(directory, progress_callback, ocr_engine))
+				self.labID_results.put(("done", cslo_ear_tag_dic))
+			except Exception as error:
+				self.labID_results.put(("error", error))
+
+		def check_for_labID_results(self):
+			# Checked through after() so the widgets and the df are only ever updated from the tkinter thread
+			while not self.labID_results.empty():
+				kind, result = self.labID_results.get()
+				if kind == "progress":
+					directory_number, number_of_directories, number_done, total = result
+					if str(self.progress_bar["mode"]) == "indeterminate":
+						self.progress_bar.stop()
+						self.progress_bar.config(mode="determinate")
+					self.progress_bar.config(maximum=max(total, 1), value=number_done)
+					self.progress_label.config(
+						text=f"Reading images: {number_done}/{total} (directory {directory_number}/{number_of_directories})"
+					)
+					continue
+
+				self.progress_window.destroy()
+				self.cslo_labID_button.config(state="normal")
+				if kind == "error":
+					messagebox.showerror(title="Lab ID", message=f"The lab IDs could not be read:\n{result}")
+				else:
+					self.apply_labIDs(result)
+				return
+
+			self.after(50, self.check_for_labID_results)
+
+		def apply_labIDs(self, cslo_ear_tag_dic):
+			# Going through the information from the images and putting it in the df
+			self.cslo_ear_tag_dic = cslo_ear_tag_dic
+			for cslo_num, et_value in self.cslo_ear_tag_dic.items():
+				# check if the cSLO number exists in the df
+				if cslo_num in self.df["cSLO number"].values:
+					# update the Lab ID
+					self.df.loc[self.df["cSLO number"] == cslo_num, "Lab ID"] = et_value
+				else:
+					# add a new row
+					new_row = {"cSLO number": cslo_num, "Lab ID": et_value}
+					self.df = pd.concat([self.df, pd.DataFrame([new_row])], ignore_index=True)
 			self.edit_mouse_info()
 
 
@@ -808,6 +1041,13 @@ def user_defined_settings():
 			self.column_entry.insert(0, number_of_columns)
 			self.column_entry.grid(row=0, column=3, padx=5, pady=5)
 
+			# Size of the compilation document, worked out from its layout alone (nothing is rendered)
+			self.size_label = tk.Label(self, text="")
+			self.size_label.grid(row=0, column=4, padx=5, pady=5, sticky="w")
+			self.pending_size_update = None
+			self.size_generation = 0
+			self.size_results = queue.Queue()
+
 			# Bind updates
 			self.row_entry.bind("<KeyRelease>", self.update_columns)
 			self.column_entry.bind("<KeyRelease>", self.update_rows)
@@ -825,22 +1065,62 @@ def user_defined_settings():
 				self.label.config(text="Row x column per group:")
 			else:
 				self.label.config(text="Row x column:")
-			
+			self.schedule_size_update()
+
+		# -- Document size readout --
+		def schedule_size_update(self, delay_ms=300):
+			# Waiting for typing to pause, then laying the document out on a worker thread
+			if self.pending_size_update is not None:
+				self.after_cancel(self.pending_size_update)
+			self.size_generation += 1
+			self.pending_size_update = self.after(delay_ms, self.start_size_update)
+
+		def start_size_update(self):
+			self.pending_size_update = None
+			generation = self.size_generation
+
+			# Copy of the settings, the worker thread must not touch tkinter
+			try:
+				confirmation_frame.collect_settings()
+			except ValueError:		# e.g. an empty row or column entry
+				self.size_label.config(text="")
+				return
+			settings = dict(confirmation_frame.settings)
+			if not settings['mouse_info_dic'] or not settings['images_to_use'] or not settings['directories']:
+				self.size_label.config(text="")
+				return
+
+			def find_document_size():
+				try:
+					(width, height), number_of_pages = ImageCompilation(settings, mode="preview_layout", headless=True).document_size()
+					if number_of_pages == 1:
+						text = f"Document: {width} x {height} px"
+					else:
+						text = f"Document: {number_of_pages} pages of up to {width} x {height} px"
+				except ValueError:		# See paginate_layout
+					text = "Document: too wide for a JPEG"
+				except Exception as error:	# Any other settings that aren't complete yet, the readout is only a guide
+					print(f"\nCould not work out the document size: {error!r}")
+					text = ""
+				self.size_results.put((generation, text))
+
+			size_thread = threading.Thread(target=find_document_size, daemon=True)
+			size_thread.start()
+			self.after(50, lambda: self.check_for_size_results(size_thread))
+
+		def check_for_size_results(self, size_thread):
+			while not self.size_results.empty():
+				generation, text = self.size_results.get()
+				if generation == self.size_generation:	# Skip sizes of rows/columns that have been changed since
+					self.size_label.config(text=text)
+
+			if size_thread.is_alive():
+				self.after(50, lambda: self.check_for_size_results(size_thread))
+
 
 		@staticmethod
 		def determine_row_and_column_number(total_number):
-			square_root = math.sqrt(total_number)
-			number_of_rows = math.floor(square_root)
-			number_of_columns = math.ceil(square_root)
-			if number_of_rows == number_of_columns:
-				number_of_rows -= 1
-				number_of_columns += 1
-			while number_of_rows * number_of_columns < total_number:
-				number_of_rows += 1
-			if number_of_rows == number_of_columns:
-				number_of_rows -= 1
-				number_of_columns += 1
-			return number_of_rows, number_of_columns
+			return determine_row_and_column_number(total_number)
 
 		# Triggered when row number is changed
 		def update_columns(self, *_):
@@ -853,6 +1133,7 @@ def user_defined_settings():
 					self.column_entry.insert(0, str(column_number))
 			except ValueError:
 				self.column_entry.delete(0, tk.END)
+			self.schedule_size_update()
 
 		# Triggered when column number is changed
 		def update_rows(self, *_):
@@ -865,6 +1146,7 @@ def user_defined_settings():
 					self.row_entry.insert(0, str(row_number))
 			except ValueError:
 				self.row_entry.delete(0, tk.END)
+			self.schedule_size_update()
 
 		
 		def get_data(self):
@@ -927,8 +1209,16 @@ def user_defined_settings():
 			pixel_label = tk.Label(self, text="pixels")
 			pixel_label.grid(row=2, column=2, padx=0, pady=0)
 
-			oct_crop_button = tk.Button(self, text="Find minimum OCT height", command=self.find_minimum_oct_height)
-			oct_crop_button.grid(row=2, column=3, padx=5, pady=0)
+			self.oct_crop_button = tk.Button(self, text="Find minimum OCT height", command=self.find_minimum_oct_height)
+			self.oct_crop_button.grid(row=2, column=3, padx=5, pady=0)
+			self.oct_height_results = queue.Queue()	# Result of the minimum OCT height worker thread
+
+			# B-scan used from multi-frame OCT volumes (settings['oct_volume_frames'] for every OCT image type)
+			oct_volume_frame_label = tk.Label(self, text="OCT volumes:")
+			oct_volume_frame_label.grid(row=3, column=0, padx=5, pady=0, sticky="w")
+			self.oct_volume_frame_var = tk.StringVar(value=oct_volume_frame_rules[default_oct_volume_frame])
+			oct_volume_frame_menu = tk.OptionMenu(self, self.oct_volume_frame_var, *oct_volume_frame_rules.values())
+			oct_volume_frame_menu.grid(row=3, column=1, columnspan=3, padx=0, pady=0, sticky="w")
 
 		def oct_crop_checkbox(self):
 			if self.oct_crop_var.get():
@@ -945,15 +1235,12 @@ def user_defined_settings():
 						oct_directory = directory[0]
 						continue
 				if oct_directory_present:
-					# list all files
-					files = sorted(os.listdir(oct_directory))
 					image_height = 0
-					# find the first file that looks like an image
-					for f in files:
-						if f.lower().endswith(('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')):
-							image_path = os.path.join(oct_directory, f)
-							with Image.open(image_path) as img:
-								_, image_height = img.size
+					# use the first image
+					oct_image_paths = DirectoryScan.for_directory(oct_directory, "oct").oct_image_paths
+					if oct_image_paths:
+						with Image.open(oct_image_paths[0]) as img:
+							_, image_height = img.size
 					if image_height > 0:
 						self.oct_crop_entry.delete(0, tk.END)
 						self.oct_crop_entry.insert(0, image_height)
@@ -966,31 +1253,60 @@ def user_defined_settings():
 		
 
 		def find_minimum_oct_height(self):
-			oct_heights = []
-
+			# The widgets are read here, the images on a worker thread (finding the retina bounds can take a while)
 			self.available_directories = directory_frame.get_data()["directories"]
+			mouse_info_dic = mouse_info_frame.get_data()["mouse_info_dic"]
+			oct_directories = [directory[0] for directory in self.available_directories if directory[1] == "oct"]
+			oct_volume_frames = self.get_data()["oct_volume_frames"]
+
+			self.oct_crop_button.config(state="disabled", text="Finding minimum OCT height...")
+			oct_height_thread = threading.Thread(
+				target=self.find_oct_heights_in_background,
+				args=(oct_directories, mouse_info_dic, oct_volume_frames),
+				daemon=True
+			)
+			oct_height_thread.start()
+			self.after(50, self.check_for_oct_height_results)
 
-			for directory in self.available_directories:
-				if directory[1] == "oct":
-					directory_path = directory[0]
-				else:
-					continue
-			
-				image_files = [
-					f for f in os.listdir(directory_path)
-					if f.lower().endswith(tuple(image_extensions)) and os.path.isfile(os.path.join(directory_path, f))
-				]
-
-				for image_file in image_files:
-					# Only including images if the user hasn't removed them
-					cslo_number = image_file.split("_")[0]
-					if cslo_number in mouse_info_frame.get_data()["mouse_info_dic"]:
-						image_path = os.path.join(directory_path, image_file)
-						image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-						top, bottom = find_oct_retina_bounds(image)
-						height = abs(bottom-top)
-						oct_heights.append(height)
-			
+		def find_oct_heights_in_background(self, oct_directories, mouse_info_dic, oct_volume_frames):
+			# Runs on the worker thread: nothing in here touches the widgets
+			try:
+				frame_rules = {}
+				for directory_path in oct_directories:
+					scan = DirectoryScan.for_directory(directory_path, "oct")
+					for image_path in scan.oct_image_paths:
+						# Only including images if the user hasn't removed them
+						cslo_number = os.path.basename(image_path).split("_")[0]
+						if cslo_number in mouse_info_dic:
+							# The same frame of each volume as when compiling (see ImageCompilation.oct_volume_frame)
+							parts = scan.image_parts.get(image_path)
+							frame_rules[image_path] = oct_volume_frame_rule(oct_volume_frames, parts[4] if parts else "")
+				oct_image_paths = list(frame_rules)
+				find_max_signal_frames([image_path for image_path, frame_rule in frame_rules.items() if frame_rule == "max_signal"])
+				frames = {image_path: choose_oct_volume_frame(image_path, frame_rule) for image_path, frame_rule in frame_rules.items()}
+
+				# Found on several processes, and kept so that the crop when compiling doesn't need to find them again
+				oct_heights = []
+				for top, bottom in find_retina_bounds_of_files(oct_image_paths, frames=frames).values():
+					height = abs(bottom-top)
+					oct_heights.append(height)
+				self.oct_height_results.put(("done", oct_heights))
+			except Exception as error:
+				self.oct_height_results.put(("error", error))
+
+		def check_for_oct_height_results(self):
+			# Checked through after() so the widgets are only ever updated from the tkinter thread
+			if self.oct_height_results.empty():
+				self.after(50, self.check_for_oct_height_results)
+				return
+
+			kind, result = self.oct_height_results.get()
+			self.oct_crop_button.config(state="normal", text="Find minimum OCT height")
+			if kind == "error":
+				messagebox.showerror(title="OCT height", message=f"The OCT heights could not be found:\n{result}")
+				return
+
+			oct_heights = result
 			if len(oct_heights) > 0:
 				self.smallest_possible_height = max(oct_heights)
 				self.oct_crop_entry.delete(0, tk.END)
@@ -1004,9 +1320,18 @@ def user_defined_settings():
 			oct_height = self.oct_crop_entry.get()
 			oct_crop_bool = self.oct_crop_var.get()
 
+			# The chosen rule for each OCT image type in the directories (nothing if it's the default)
+			oct_volume_frames = {}
+			frame_rule = next(rule for rule, name in oct_volume_frame_rules.items() if name == self.oct_volume_frame_var.get())
+			if frame_rule != default_oct_volume_frame:
+				for image_type in images_to_use_frame.available_image_types:
+					if image_type.startswith("OCT "):
+						oct_volume_frames[image_type[len("OCT "):]] = frame_rule
+
 			return {
 				"oct_crop_bool": oct_crop_bool,
-				"oct_height": oct_height
+				"oct_height": oct_height,
+				"oct_volume_frames": oct_volume_frames
 			}
 
 
@@ -1056,71 +1381,44 @@ def user_defined_settings():
 		# --- Populate available options ---
 		def determine_what_images_are_available(self):
 			directories = directory_frame.get_data()["directories"]
-			self.available_image_types_set = set()
-
-			for directory, image_type in directories:
-				if image_type == "oct":
-					image_files = [
-						f for f in os.listdir(directory)
-						if os.path.isfile(os.path.join(directory, f))
-						and os.path.splitext(f)[1].lower() in image_extensions
-					]
-					for image_file in image_files:
-						oct_type = "OCT " + image_file.split("_")[2]
-						self.available_image_types_set.add(oct_type)
-				
-				elif image_type =="cslo":
-					image_files = []
-					
-					# Grabbing all cSLO file names
-					for subdir, dirs, files in os.walk(directory):
-						if os.path.basename(subdir) in {"OD", "OS"}:
-							for f in files:
-								if os.path.splitext(f)[1].lower() in image_extensions:
-									image_files.append(f)
-					
-					cslo_images_dic = {}
-					for image in image_files:
-						image_base = os.path.splitext(image)[0]
-						image_number, mouse_number, eye, image_type = image_base.split("_")
-						mouse_eye = mouse_number + "_" + eye
+			self.set_available_image_types(self.find_available_image_types(directories))
 
-						if mouse_eye not in cslo_images_dic:
-							cslo_images_dic[mouse_eye] = {}
+		@staticmethod
+		def find_available_image_types(directories, check_if_cancelled=None):
+			"""Return the sorted image types in the directories. Doesn't touch any widgets (can run on a worker thread)."""
+			available_image_types_set = set()
 
-						if image_type not in cslo_images_dic[mouse_eye]:
-							cslo_images_dic[mouse_eye][image_type] = 0
+			def ordinal(n):
+				if 10 <= n % 100 <= 20:
+					suffix = "th"
+				else:
+					suffix = {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+				return f"{n}{suffix}"
 
-						cslo_images_dic[mouse_eye][image_type] += 1
-					
-					max_counts = {}
-					for mouse_eye, counts in cslo_images_dic.items():
-						for image_type, count in counts.items():
-							if image_type not in max_counts or count > max_counts[image_type]:
-								max_counts[image_type] = count
-
-					def ordinal(n):
-						if 10 <= n % 100 <= 20:
-							suffix = "th"
-						else:
-							suffix = {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
-						return f"{n}{suffix}"
+			for directory, imager in directories:
+				scan = DirectoryScan.for_directory(directory, imager, check_if_cancelled=check_if_cancelled)
 
-					for image_type, count in max_counts.items():
+				if imager == "oct":
+					for modality in scan.max_image_counts():
+						available_image_types_set.add("OCT " + modality)
+				
+				elif imager == "cslo":
+					for image_type, count in scan.max_image_counts().items():
 						image_type = "cSLO " + image_type
 						if int(count) == 1:
-							self.available_image_types_set.add(image_type)
+							available_image_types_set.add(image_type)
 						else:
-							self.available_image_types_set.discard(image_type)
-							i = 0
+							available_image_types_set.discard(image_type)
 							for i in range(int(count)):
 								image_type_ammended = f"{image_type} ({ordinal(i+1)})"
-								self.available_image_types_set.add(image_type_ammended)
-								self.available_image_types_set.add(f"{image_type} [select]")
-						
+								available_image_types_set.add(image_type_ammended)
+								available_image_types_set.add(f"{image_type} [select]")
 
+			return sorted(list(available_image_types_set))
 
-			self.available_image_types = sorted(list(self.available_image_types_set))
+		def set_available_image_types(self, available_image_types):
+			self.available_image_types_set = set(available_image_types)
+			self.available_image_types = list(available_image_types)
 			self.refresh_available_list()
 
 
@@ -1184,16 +1482,7 @@ def user_defined_settings():
 
 
 			# Determining initial custom name
-			custom_name = selection
-			if custom_name[:5] == "cSLO ":
-				custom_name = custom_name[5:]
-			elif custom_name[:4] == "OCT ":
-				custom_name = custom_name[4:]
-			if custom_name[-9:] == " [select]":
-				custom_name = custom_name[:-9]
-			ordinal_format = r" \(\d+(st|nd|rd|th)\)$"
-			custom_name = re.sub(ordinal_format, "", custom_name)
-			custom_name = custom_name[0].upper() + custom_name[1:]
+			custom_name = default_custom_name(selection)
 
 			image_type_name_var = tk.StringVar(value=custom_name)
 			entry_box = tk.Entry(frame, textvariable=image_type_name_var, width=15)
@@ -1394,6 +1683,10 @@ def user_defined_settings():
 			settings_button = tk.Button(self, text="Print Settings", command=self.grab_settings)
 			settings_button.grid(row=0, column=3, padx=5)
 
+			# Save settings button (the saved file can be rendered later without this dialog)
+			save_settings_button = tk.Button(self, text="Save Settings", command=self.save_settings)
+			save_settings_button.grid(row=0, column=4, padx=5)
+
 
 		def collect_settings(self):
 			self.settings = {}
@@ -1459,6 +1752,16 @@ def user_defined_settings():
 			for key, value in self.settings.items():
 				print(f"{key}: {value}")
 
+		def save_settings(self):
+			self.collect_settings()
+			settings_file_path = filedialog.asksaveasfilename(
+				defaultextension=".json",
+				filetypes=[("JSON settings", "*.json"), ("YAML settings", "*.yaml *.yml")]
+			)
+			if settings_file_path:
+				save_settings_file(self.settings, settings_file_path)
+				status(f"Settings saved to {settings_file_path}")
+
 
 
 
@@ -1491,21 +1794,1240 @@ def user_defined_settings():
 	save_location_frame.pack(anchor='w')
 	confirmation_frame.pack(anchor='s', pady=10)
 
-
+	# The rest of the packages are imported while the user is filling in the settings
+	root.after(100, import_packages_in_background, pd, cv2)
 
 	root.mainloop()
 	return confirmation_frame.settings
 
 
 
+"""
+----------------------
+--- Settings files ---
+----------------------
+"""
+
+def determine_row_and_column_number(total_number):
+	square_root = math.sqrt(total_number)
+	number_of_rows = math.floor(square_root)
+	number_of_columns = math.ceil(square_root)
+	if number_of_rows == number_of_columns:
+		number_of_rows -= 1
+		number_of_columns += 1
+	while number_of_rows * number_of_columns < total_number:
+		number_of_rows += 1
+	if number_of_rows == number_of_columns:
+		number_of_rows -= 1
+		number_of_columns += 1
+	return number_of_rows, number_of_columns
+
+
+def default_custom_name(image_type):
+	"""Turn an image type string (e.g. 'cSLO BAF (1st)') into the label shown in the document (e.g. 'BAF')."""
+	custom_name = image_type
+	if custom_name[:5] == "cSLO ":
+		custom_name = custom_name[5:]
+	elif custom_name[:4] == "OCT ":
+		custom_name = custom_name[4:]
+	if custom_name[-9:] == " [select]":
+		custom_name = custom_name[:-9]
+	ordinal_format = r" \(\d+(st|nd|rd|th)\)$"
+	custom_name = re.sub(ordinal_format, "", custom_name)
+	custom_name = custom_name[0].upper() + custom_name[1:]
+	return custom_name
+
+
+def save_settings_file(settings, settings_file_path):
+	"""Write the settings collected by the dialog box to a JSON/YAML file."""
+	extension = os.path.splitext(settings_file_path)[1].lower()
+	with open(settings_file_path, "w", encoding="utf-8") as f:
+		if extension in (".yaml", ".yml"):
+			import yaml
+			# Tuples are written as lists so the file stays plain YAML
+			yaml.safe_dump(json.loads(json.dumps(settings)), f, sort_keys=False)
+		else:
+			json.dump(settings, f, indent=4)
+
+
+def load_settings_file(settings_file_path):
+	"""
+	Read a JSON/YAML settings file into the same dictionary that the settings dialog box produces.
+	Only the directories, mouse info, image types and output location are required, everything else
+	falls back to the dialog box defaults.
+	"""
+	extension = os.path.splitext(settings_file_path)[1].lower()
+	with open(settings_file_path, "r", encoding="utf-8") as f:
+		if extension in (".yaml", ".yml"):
+			try:
+				import yaml
+			except ImportError:
+				raise ImportError("PyYAML is needed to read YAML settings files (pip install pyyaml)")
+			loaded_settings = yaml.safe_load(f) or {}
+		else:
+			loaded_settings = json.load(f)
+
+	missing_keys = [key for key in ("directories", "mouse_info_dic", "images_to_use") if key not in loaded_settings]
+	if "final_product_file_path" not in loaded_settings and "save_directory" not in loaded_settings:
+		missing_keys.append("final_product_file_path")
+	if missing_keys:
+		raise ValueError(f"{settings_file_path} is missing: {', '.join(missing_keys)}")
+
+	settings = dict(loaded_settings)
+
+	# JSON/YAML have no tuples, so convert lists back to what the dialog box would have produced
+	settings['directories'] = [(str(directory), imager) for directory, imager in loaded_settings['directories']]
+	settings['mouse_info_dic'] = dict(sorted(
+		(str(mouse), tuple(info)) for mouse, info in loaded_settings['mouse_info_dic'].items()
+	))
+	images_to_use = []
+	for image_type in loaded_settings['images_to_use']:
+		if isinstance(image_type, str):	# Allow only the image type to be given, e.g. "cSLO BAF (1st)"
+			images_to_use.append((image_type, default_custom_name(image_type)))
+		else:
+			original, custom_name = image_type
+			images_to_use.append((original, custom_name))
+	settings['images_to_use'] = images_to_use
+
+	# Defaults for anything not in the file (matching the dialog box defaults)
+	settings.setdefault('document_title', "In vivo imaging")
+	settings.setdefault('subtitle', datetime.today().strftime("%B %d, %Y").replace(" 0", " "))
+	settings.setdefault('group_order', [])
+	settings.setdefault('cslo_number_bool', True)
+	settings.setdefault('labID_bool', False)
+	settings.setdefault('crop_cslo_text_bool', True)
+	settings.setdefault('oct_crop_bool', False)
+	settings.setdefault('oct_height', "")
+
+	# Frame rules of OCT volumes are checked now, rather than failing once the images are being drawn
+	oct_volume_frames = settings.get('oct_volume_frames') or {}
+	if not isinstance(oct_volume_frames, dict):
+		raise ValueError(f"{settings_file_path}: oct_volume_frames must give a frame rule for each image type, "
+						 f"e.g. {{\"volume\": \"max_signal\"}}")
+	for image_type_name, frame_rule in oct_volume_frames.items():
+		if not is_oct_volume_frame_rule(frame_rule):
+			raise ValueError(f"{settings_file_path}: the OCT volume frame of {image_type_name!r} is {frame_rule!r} "
+							 f"(use \"center\", \"max_signal\" or a frame number counting from 0)")
+
+	if 'number_of_rows' not in settings or 'number_of_columns' not in settings:
+		if settings['group_order']:
+			groups = [info[1] for info in settings['mouse_info_dic'].values()]
+			number_of_mice = max(groups.count(group) for group in settings['group_order'])
+		else:
+			number_of_mice = len(settings['mouse_info_dic'])
+		number_of_rows, number_of_columns = determine_row_and_column_number(number_of_mice)
+		settings.setdefault('number_of_rows', number_of_rows)
+		settings.setdefault('number_of_columns', number_of_columns)
+
+	# Output location
+	if 'final_product_file_path' not in settings:
+		file_name = settings.get('file_name', "in_vivo_image_compilation")
+		if not file_name.lower().endswith(".jpg"):
+			file_name += ".jpg"
+		settings['file_name'] = file_name
+		settings['final_product_file_path'] = os.path.join(settings['save_directory'], file_name)
+	save_directory = os.path.dirname(settings['final_product_file_path'])
+	if save_directory:
+		os.makedirs(save_directory, exist_ok=True)
+	settings['valid_save_directory'] = True
+	settings.setdefault('file_name', os.path.basename(settings['final_product_file_path']))
+
+	return settings
+
+
+
+"""
+---------------------
+--- Image catalog ---
+---------------------
+"""
+
+def write_file_atomically(file_path, write):
+	"""
+	Call write(temporary_file_path), then move the temporary file over file_path, so nothing ever reads half a file
+	(e.g. if the program is stopped while writing, or another thread is reading). Raises OSError if it can't be written.
+	"""
+	temporary_file_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	try:
+		os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+		write(temporary_file_path)
+		os.replace(temporary_file_path, file_path)
+	except OSError:
+		with contextlib.suppress(OSError):
+			os.remove(temporary_file_path)
+		raise
+
+
+def save_cache_file(file_path, write):
+	"""write_file_atomically for the caches: they can always be made again, so failures are ignored. Returns True if saved."""
+	try:
+		write_file_atomically(file_path, write)
+		return True
+	except OSError:
+		return False
+
+
+def json_writer(data, indent=None):
+	"""A write function for write_file_atomically/save_cache_file that saves data as JSON."""
+	def write(file_path):
+		with open(file_path, "w", encoding="utf-8") as f:
+			json.dump(data, f, indent=indent)
+	return write
+
+
+class SharedInstance:
+	"""Gives a class one instance that is shared for the whole session, returned by cls.shared()."""
+	shared_instances = {}		# class -> instance
+	shared_instances_lock = threading.RLock()
+
+	@classmethod
+	def shared(cls):
+		with SharedInstance.shared_instances_lock:
+			if cls not in SharedInstance.shared_instances:
+				SharedInstance.shared_instances[cls] = cls()
+			return SharedInstance.shared_instances[cls]
+
+
+class ImageCatalog:
+	"""
+	Listing of every image file under one root directory that is kept on disk between launches.
+	Each folder's listing is stored together with the folder's mtime, so only folders whose contents
+	changed are listed again; unchanged folders are served straight from the catalog file.
+	"""
+	catalog_version = 1
+	racy_window_ns = 2_000_000_000	# Folders modified this close to being listed are listed again next time (coarse NAS timestamps)
+	catalogs = {}					# One catalog per root directory for the whole session
+	catalogs_lock = threading.Lock()
+
+	def __init__(self, root_directory):
+		self.root_directory = os.path.normpath(os.path.abspath(root_directory))
+		catalog_name = hashlib.sha1(self.root_directory.encode("utf-8")).hexdigest() + ".json"
+		self.catalog_file_path = os.path.join(cache_directory, "catalogs", catalog_name)
+		self.folders = {}		# relative folder path -> {"mtime", "listed", "subdirs", "files"}
+		self.changed = False
+		self.lock = threading.RLock()	# The settings dialog box reads catalogs from a worker thread
+		self.load()
+
+	@classmethod
+	def for_directory(cls, root_directory):
+		"""Return the (shared) catalog for a root directory."""
+		root_directory = os.path.normpath(os.path.abspath(root_directory))
+		with cls.catalogs_lock:
+			if root_directory not in cls.catalogs:
+				cls.catalogs[root_directory] = cls(root_directory)
+			return cls.catalogs[root_directory]
+
+	def load(self):
+		try:
+			with open(self.catalog_file_path, "r", encoding="utf-8") as f:
+				catalog = json.load(f)
+		except (OSError, ValueError):
+			return
+		if catalog.get("version") == self.catalog_version and catalog.get("root_directory") == self.root_directory:
+			self.folders = catalog["folders"]
+
+	def save(self):
+		"""Write the catalog to disk if anything was re-listed."""
+		with self.lock:
+			if not self.changed:
+				return
+			catalog = {
+				"version": self.catalog_version,
+				"root_directory": self.root_directory,
+				"folders": self.folders
+			}
+			if save_cache_file(self.catalog_file_path, json_writer(catalog)):
+				self.changed = False
+
+	def folder(self, folder_path):
+		"""Return the catalog entry for one folder, only listing it again if its mtime changed."""
+		folder_path = os.path.normpath(os.path.abspath(folder_path))
+		relative_path = os.path.relpath(folder_path, self.root_directory)
+		mtime = os.stat(folder_path).st_mtime_ns
+
+		with self.lock:
+			entry = self.folders.get(relative_path)
+			if entry is None or entry["mtime"] != mtime or entry["listed"] - mtime < self.racy_window_ns:
+				previous_entry = entry
+				entry = self.list_folder(folder_path, mtime)
+				# Image headers already read are kept for files that didn't change
+				if previous_entry is not None:
+					for file_name, file_record in entry["files"].items():
+						previous_record = previous_entry["files"].get(file_name)
+						if (previous_record and "header" in previous_record and previous_record["size"] == file_record["size"]
+								and previous_record["mtime"] == file_record["mtime"]):
+							file_record["header"] = previous_record["header"]
+				self.folders[relative_path] = entry
+				self.changed = True
+		return entry
+
+	@staticmethod
+	def list_folder(folder_path, mtime):
+		subdirs = []
+		files = {}
+		# Images in OD/OS folders are cSLO images, any others are OCT images
+		cslo_or_oct = "cslo" if os.path.basename(folder_path) in {"OD", "OS"} else "oct"
+		with os.scandir(folder_path) as folder_contents:
+			for item in folder_contents:
+				if item.is_dir():
+					subdirs.append(item.name)
+				elif os.path.splitext(item.name)[1].lower() in image_extensions and item.is_file():
+					item_stat = item.stat()
+					try:
+						parts = list(ImageCompilation.convert_path_to_base_name_and_parts(item.name, cslo_or_oct))
+					except IndexError:	# File name doesn't follow the naming convention
+						parts = None
+					files[item.name] = {"size": item_stat.st_size, "mtime": item_stat.st_mtime_ns, "parts": parts}
+
+		return {
+			"mtime": mtime,
+			"listed": time.time_ns(),
+			"subdirs": sorted(subdirs),
+			"files": dict(sorted(files.items()))
+		}
+
+	def subdirs(self, folder_path):
+		"""Names of the subfolders of a folder."""
+		return self.folder(folder_path)["subdirs"]
+
+	def files(self, folder_path):
+		"""Image files of a folder: {file name: {"size", "mtime", "parts"}}, parts as from convert_path_to_base_name_and_parts."""
+		return self.folder(folder_path)["files"]
+
+	def image_header(self, image_path):
+		"""
+		[width, height, number of frames] of an image file in the catalog. The header is only read the first time,
+		then it is kept in the file's record, so laying out a document doesn't open any images.
+		"""
+		folder_path, file_name = os.path.split(os.path.normpath(os.path.abspath(image_path)))
+		relative_path = os.path.relpath(folder_path, self.root_directory)
+		with self.lock:
+			entry = self.folders.get(relative_path)
+			if entry is None or file_name not in entry["files"]:
+				entry = self.folder(folder_path)
+			file_record = entry["files"].get(file_name)
+			if file_record is not None and "header" in file_record:
+				return file_record["header"]
+
+		header = self.read_image_header(image_path)
+		if file_record is not None:
+			with self.lock:
+				file_record["header"] = header
+				self.changed = True
+		return header
+
+	@staticmethod
+	def read_image_header(image_path):
+		"""[width, height, number of frames] of an image, from its header (raises OSError/UnidentifiedImageError if unreadable)."""
+		with Image.open(image_path) as image:
+			return [image.width, image.height, getattr(image, "n_frames", 1)]	# n_frames only reads the frame headers
+
+	def walk(self, folder_path=None):
+		"""Same as os.walk (top-down), but yields the image file records instead of a list of file names."""
+		folder_path = self.root_directory if folder_path is None else folder_path
+		entry = self.folder(folder_path)
+		yield folder_path, entry["subdirs"], entry["files"]
+		for subdir in entry["subdirs"]:
+			yield from self.walk(os.path.join(folder_path, subdir))
+
+
+class DirectoryScan:
+	"""
+	Everything that is needed to know about one image directory, worked out in a single pass over its catalog.
+	One scan per directory is shared by all of the settings dialog box frames and by ImageCompilation.
+	"""
+	scans = {}		# (directory, imager) -> DirectoryScan
+	scans_lock = threading.Lock()
+
+	def __init__(self, directory, imager, check_if_cancelled=None):
+		self.directory = directory
+		self.imager = imager
+		self.mice = set()
+		self.image_counts = {}			# (mouse, eye, modality) -> number of images
+		self.image_parts = {}			# image path -> parts from convert_path_to_base_name_and_parts (None if the name doesn't fit)
+		self.cslo_image_paths = {}		# mouse folder -> {"OD": [paths], "OS": [paths]}
+		self.oct_image_paths = []
+
+		catalog = ImageCatalog.for_directory(directory)
+		if imager == "cslo":
+			self.scan_cslo_directory(catalog, check_if_cancelled)
+		elif imager == "oct":
+			self.scan_oct_directory(catalog)
+		catalog.save()
+
+	@classmethod
+	def for_directory(cls, directory, imager, rescan=False, check_if_cancelled=None):
+		"""Return the shared scan of a directory, only scanning it if it hasn't been yet (or if rescan is True)."""
+		key = (os.path.normpath(os.path.abspath(directory)), imager)
+		with cls.scans_lock:
+			scan = cls.scans.get(key)
+		if scan is None or rescan:
+			scan = cls(directory, imager, check_if_cancelled)
+			with cls.scans_lock:
+				cls.scans[key] = scan
+		return scan
+
+	def add_image(self, path, parts):
+		self.image_parts[path] = parts
+		if parts:
+			_, _, mouse_number, eye, modality = parts
+			self.image_counts[(mouse_number, eye, modality)] = self.image_counts.get((mouse_number, eye, modality), 0) + 1
+
+	def scan_cslo_directory(self, catalog, check_if_cancelled=None):
+		# Each subfolder is a mouse, with the images inside OD and OS folders
+		for mouse_folder in catalog.subdirs(self.directory):
+			if check_if_cancelled:
+				check_if_cancelled()
+			mouse_folder_path = os.path.join(self.directory, mouse_folder)
+
+			# Only counting it as a mouse if both "OD" and "OS" exist as folders
+			sub_items = catalog.subdirs(mouse_folder_path)
+			if "OD" in sub_items and "OS" in sub_items:
+				self.mice.add(mouse_folder)
+
+			eye_image_paths = {"OD": [], "OS": []}
+			for folder_path, _, files in catalog.walk(mouse_folder_path):	# recursively walk all subfolders
+				eye = os.path.basename(folder_path)
+				if eye in eye_image_paths:
+					for file_name, file_record in files.items():
+						path = os.path.join(folder_path, file_name)
+						eye_image_paths[eye].append(path)
+						self.add_image(path, file_record["parts"])
+			self.cslo_image_paths[mouse_folder] = eye_image_paths
+
+	def scan_oct_directory(self, catalog):
+		# All of the OCT images are directly in the directory
+		for file_name, file_record in catalog.files(self.directory).items():
+			path = os.path.join(self.directory, file_name)
+			self.oct_image_paths.append(path)
+			self.mice.add(file_name.split("_")[0])
+			self.add_image(path, file_record["parts"])
+
+	def max_image_counts(self):
+		"""Largest number of images of each modality for any one mouse eye, e.g. {"BAF": 1, "IRAF": 3}."""
+		max_counts = {}
+		for (_, _, modality), count in self.image_counts.items():
+			max_counts[modality] = max(count, max_counts.get(modality, 0))
+		return max_counts
+
+	def first_cslo_image_path(self, mouse_folder):
+		"""First image of a mouse, preferring OD over OS (None if there aren't any)."""
+		eye_image_paths = self.cslo_image_paths.get(mouse_folder, {})
+		for eye in ("OD", "OS"):
+			if eye_image_paths.get(eye):
+				return eye_image_paths[eye][0]
+		return None
+
+
+
+class FileResultCache(SharedInstance):
+	"""
+	Results worked out from image files (e.g. OCR text, retina bounds), kept in memory and on disk between launches.
+	Keyed by path, file size and mtime, so a result is only worked out again if the file changed.
+	Each subclass sets its own cache_file_path.
+	"""
+	cache_version = 1
+	cache_file_path = None
+
+	def __init__(self):
+		self.results = {}
+		self.changed = False
+		self.lock = threading.Lock()
+		self.load()
+
+	@staticmethod
+	def key(image_path, variant=""):
+		image_stat = os.stat(image_path)
+		return f"{os.path.abspath(image_path)}|{image_stat.st_size}|{image_stat.st_mtime_ns}|{variant}"
+
+	def load(self):
+		try:
+			with open(self.cache_file_path, "r", encoding="utf-8") as f:
+				cache = json.load(f)
+		except (OSError, ValueError):
+			return
+		# Anything unexpected (an old format, or a file that isn't ours) is treated as an empty cache
+		if isinstance(cache, dict) and cache.get("version") == self.cache_version and isinstance(cache.get("results"), dict):
+			self.results = cache["results"]
+
+	def get(self, image_path, variant=""):
+		try:
+			key = self.key(image_path, variant)
+		except OSError:
+			return None
+		with self.lock:
+			return self.results.get(key)
+
+	def set(self, image_path, result, variant=""):
+		try:
+			key = self.key(image_path, variant)
+		except OSError:
+			return
+		with self.lock:
+			self.results[key] = result
+			self.changed = True
+
+	def save(self):
+		"""Write the cache to disk if anything was added, without the results of files that were deleted or changed since."""
+		with self.lock:
+			if not self.changed:
+				return
+			keys = list(self.results)
+
+		# Every file is only checked once (its results for each variant share the path, size and mtime), outside the lock
+		file_identities = {}
+		stale_keys = []
+		for key in keys:
+			image_path, size, mtime_ns, _ = key.split("|", 3)	# Variants can have a | in them (paths can't on Windows)
+			if image_path not in file_identities:
+				try:
+					image_stat = os.stat(image_path)
+					file_identities[image_path] = (str(image_stat.st_size), str(image_stat.st_mtime_ns))
+				except OSError:
+					file_identities[image_path] = None
+			if file_identities[image_path] != (size, mtime_ns):
+				stale_keys.append(key)
+
+		with self.lock:
+			for key in stale_keys:
+				self.results.pop(key, None)
+			cache = {"version": self.cache_version, "results": self.results}
+			if save_cache_file(self.cache_file_path, json_writer(cache)):
+				self.changed = False
+
+
+
+class TileCache:
+	"""
+	Processed image tiles (opened, cropped and resized), kept on disk as PPM files between launches, so re-running
+	a compilation after changing only the layout (title, groups, columns...) reads the tiles back instead of
+	decoding and resizing every image again. When the cache is bigger than max_bytes, the least recently used
+	tiles are deleted.
+	"""
+	cache_version = 1
+	tile_directory = os.path.join(cache_directory, "tiles")
+	file_format = "PPM"
+	file_extension = ".ppm"
+	cacheable_modes = {"L", "RGB"}		# Modes that PPM/PGM files store exactly
+
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+
+	@classmethod
+	def key(cls, operations, parameters):
+		"""
+		Key of a tile: the source images (path, size and mtime), the operations that make the tile from them
+		and any other parameters that change the pixels. None if a source image can't be found.
+		"""
+		sources = []
+		for operation in operations:
+			if operation["op"] == "open":
+				try:
+					image_stat = os.stat(operation["path"])
+				except OSError:
+					return None
+				sources.append([os.path.abspath(operation["path"]), image_stat.st_size, image_stat.st_mtime_ns])
+		description = json.dumps([cls.cache_version, sources, operations, parameters], sort_keys=True)
+		return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+	def tile_path(self, key):
+		return os.path.join(self.tile_directory, f"{key}{self.file_extension}")
+
+	def get(self, key):
+		"""The cached tile (None if there isn't one)."""
+		tile_path = self.tile_path(key)
+		try:
+			with Image.open(tile_path) as tile:
+				tile.load()
+			os.utime(tile_path)		# The mtime of a tile file is when it was last used
+		except (OSError, UnidentifiedImageError):
+			return None
+		return tile
+
+	def set(self, key, tile):
+		"""Save a tile."""
+		if tile.mode not in self.cacheable_modes:
+			return
+		save_cache_file(self.tile_path(key), lambda file_path: tile.save(file_path, format=self.file_format))
+
+	def evict(self):
+		"""Delete the least recently used tiles until the cache is no bigger than max_bytes."""
+		try:
+			with os.scandir(self.tile_directory) as folder_contents:
+				tiles = [(item.stat().st_mtime_ns, item.stat().st_size, item.path)
+						for item in folder_contents if item.name.endswith(self.file_extension)]
+		except OSError:
+			return
+		total_bytes = sum(size for _, size, _ in tiles)
+		for _, size, tile_path in sorted(tiles):
+			if total_bytes <= self.max_bytes:
+				break
+			try:
+				os.remove(tile_path)
+				total_bytes -= size
+			except OSError:
+				pass
+
+
+
+class ThumbnailCache(TileCache, SharedInstance):
+	"""
+	Thumbnails shown when choosing between [select] images, kept on disk (as JPEGs, they are only for display)
+	and in memory for the session, so each dialog box doesn't need to read the full images again.
+	"""
+	tile_directory = os.path.join(cache_directory, "thumbnails")
+	file_format = "JPEG"
+	file_extension = ".jpg"
+	max_memory_bytes = 128 * 1024 * 1024
+
+	def __init__(self, max_bytes=256 * 1024 * 1024):
+		super().__init__(max_bytes)
+		self.thumbnails = collections.OrderedDict()		# key -> thumbnail (most recently used last)
+		self.memory_bytes = 0
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			thumbnail = self.thumbnails.get(key)
+			if thumbnail is not None:
+				self.thumbnails.move_to_end(key)
+				return thumbnail
+		thumbnail = super().get(key)
+		if thumbnail is not None:
+			self.keep_in_memory(key, thumbnail)
+		return thumbnail
+
+	def set(self, key, thumbnail):
+		super().set(key, thumbnail)
+		self.keep_in_memory(key, thumbnail)
+
+	def keep_in_memory(self, key, thumbnail):
+		with self.lock:
+			if key in self.thumbnails:
+				return
+			self.thumbnails[key] = thumbnail
+			self.memory_bytes += thumbnail.width * thumbnail.height * len(thumbnail.getbands())
+			while self.memory_bytes > self.max_memory_bytes and len(self.thumbnails) > 1:
+				_, dropped_thumbnail = self.thumbnails.popitem(last=False)
+				self.memory_bytes -= dropped_thumbnail.width * dropped_thumbnail.height * len(dropped_thumbnail.getbands())
+
+
+def load_thumbnail(image_path, size):
+	"""
+	Thumbnail of an image, stretched to size (width, height) like the dialog box always has.
+	JPEGs are decoded at reduced resolution, and thumbnails made before come from ThumbnailCache.
+	"""
+	cache = ThumbnailCache.shared()
+	key = cache.key([{"op": "open", "path": image_path}, {"op": "thumbnail", "size": list(size)}], {})
+	thumbnail = cache.get(key) if key is not None else None
+	if thumbnail is None:
+		with Image.open(image_path) as image:
+			image.draft(image.mode, size)		# Only JPEG decoders can skip resolution, anything else ignores this
+			if image.mode not in ("L", "RGB"):
+				image = image.convert("RGB")
+			thumbnail = image.resize(tuple(size), Image.BILINEAR, reducing_gap=2.0)
+		if key is not None:
+			cache.set(key, thumbnail)
+	return thumbnail
+
+
+class MouseGridCache(SharedInstance):
+	"""
+	The image grid (tiles) of each mouse rendered in this session, kept in memory so that previewing again or
+	pressing OK after a preview only redoes the layout and text. Each tile is found by its key from TileCache.key,
+	which covers every setting that changes its pixels, so a grid can be partly reused (e.g. the preview has
+	placeholders for [select] images). The grids of the least recently rendered mice are dropped beyond max_bytes.
+	"""
+
+	def __init__(self):
+		self.grids = collections.OrderedDict()		# mouse -> {tile key: tile}
+		self.total_bytes = 0
+		self.lock = threading.Lock()
+
+	@staticmethod
+	def size_in_bytes(grid):
+		return sum(tile.width * tile.height * len(tile.getbands()) for tile in grid.values())
+
+	def get(self, mouse_id, tile_keys):
+		"""The tiles of a mouse with these keys (None for any that aren't cached)."""
+		with self.lock:
+			grid = self.grids.get(mouse_id, {})
+			if grid:
+				self.grids.move_to_end(mouse_id)
+			return [grid.get(tile_key) for tile_key in tile_keys]
+
+	def set(self, mouse_id, grid, max_bytes):
+		"""Keep the grid of a mouse ({tile key: tile}), replacing the one from before."""
+		size = self.size_in_bytes(grid)
+		with self.lock:
+			old_grid = self.grids.pop(mouse_id, None)
+			if old_grid is not None:
+				self.total_bytes -= self.size_in_bytes(old_grid)
+			if size > max_bytes:
+				return
+			self.grids[mouse_id] = grid
+			self.total_bytes += size
+			while self.total_bytes > max_bytes:
+				_, dropped_grid = self.grids.popitem(last=False)
+				self.total_bytes -= self.size_in_bytes(dropped_grid)
+
+
+
+"""
+----------------------------------------
+--- Reading lab IDs from cSLO images ---
+----------------------------------------
+"""
+
+class FooterTextCache(FileResultCache):
+	"""Text read from the footer of cSLO images, kept separately for each OCR engine (the variant)."""
+	cache_version = 3				# Version 2 kept every engine's text under the same key
+	cache_file_path = os.path.join(cache_directory, "footer_text.json")
+
+
+def read_cslo_footer(image_path):
+	"""
+	Return the bottom left part of a cSLO image's footer (where the mouse number and lab ID are written)
+	as a grayscale array, or None if the image can't be read.
+	"""
+	try:
+		with Image.open(image_path) as img:
+			img.draft("L", img.size)	# JPEGs are decoded straight to grayscale (no color conversion)
+			width, height = img.size
+
+			# crop bottom-left region
+			top_square_height = width
+			bottom_rect_height = height - top_square_height
+			crop_height = (bottom_rect_height // 3) + 10
+			crop_width = int(width * 0.70)  # left 70% of image
+
+			footer = img.crop((0, top_square_height, crop_width, top_square_height + crop_height)).convert("L")
+	except (OSError, UnidentifiedImageError):
+		return None
+	return np.asarray(footer)
+
+
+class FooterGlyphTemplates(SharedInstance):
+	"""
+	Fast OCR engine for cSLO footers, which the instrument always writes in the same font.
+	Each character (glyph) of a footer is cut out and compared with learned glyph templates by normalized
+	cross-correlation (one matrix multiplication for the whole footer). Templates are learned from footers
+	whose text is known, e.g. confident EasyOCR reads, and kept on disk between launches.
+	"""
+	templates_version = 2
+	templates_file_path = os.path.join(cache_directory, "footer_glyphs.json")
+	glyph_size = 32					# Footers are scaled to this height, and each glyph is padded to a square
+	minimum_score = 0.85			# Lowest correlation accepted for a glyph
+	minimum_margin = 0.03			# Best character must beat the second best by this much
+	minimum_count = 5				# A character is only read once it has been learned from this many glyphs
+	glyph_shifts = (-1, 0, 1)		# Glyphs are also compared shifted sideways by a pixel (antialiasing moves their edges)
+
+	def __init__(self):
+		self.glyph_sums = {}		# character -> sum of the normalized glyphs seen for it
+		self.glyph_counts = {}		# character -> number of glyphs seen
+		self.width_sums = {}		# character -> sum of the widths of the glyphs seen (pixels of the footer)
+		self.space_gaps = []		# Smallest and largest gap seen where there is a space (pixels of the footer)
+		self.letter_gaps = []		# Smallest and largest gap seen between the characters of a word
+		self.changed = False
+		self.lock = threading.Lock()
+		self.load()
+
+	def load(self):
+		try:
+			with open(self.templates_file_path, "r", encoding="utf-8") as f:
+				templates = json.load(f)
+		except (OSError, ValueError):
+			return
+		if templates.get("version") == self.templates_version and templates.get("glyph_size") == self.glyph_size:
+			for character, glyph in templates["glyphs"].items():
+				self.glyph_sums[character] = np.array(glyph["sum"], dtype=np.float32)
+				self.glyph_counts[character] = glyph["count"]
+				self.width_sums[character] = glyph["width_sum"]
+			self.space_gaps = templates["space_gaps"]
+			self.letter_gaps = templates["letter_gaps"]
+
+	def save(self):
+		"""Write the templates to disk if any were learned."""
+		with self.lock:
+			if not self.changed:
+				return
+			templates = {
+				"version": self.templates_version,
+				"glyph_size": self.glyph_size,
+				"glyphs": {
+					character: {
+						"sum": self.glyph_sums[character].round(4).tolist(),
+						"count": self.glyph_counts[character],
+						"width_sum": self.width_sums[character]
+					}
+					for character in self.glyph_sums
+				},
+				"space_gaps": self.space_gaps,
+				"letter_gaps": self.letter_gaps
+			}
+			if save_cache_file(self.templates_file_path, json_writer(templates)):
+				self.changed = False
+
+	def segment(self, footer):
+		"""
+		Cut a grayscale footer (one line of text) into glyphs. Returns the scaled glyphs, their widths in
+		pixels of the footer, and for every glyph the gap before it (0 for the first one).
+		"""
+		# Light text on a dark background (inverted if the footer is mostly light)
+		if footer.mean() > 127:
+			footer = 255 - footer
+		_, ink = cv2.threshold(footer, 0, 1, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+		# Glyphs are runs of columns with ink in them (which of the gaps between them are spaces is learned)
+		footer_height = footer.shape[0]
+		glyph_runs = [(left, right) for left, right in self.runs(ink.any(axis=0)) if right - left <= footer_height]
+		if not glyph_runs:
+			return np.zeros((0, self.glyph_size, self.glyph_size), dtype=np.float32), [], []
+		gaps = [0] + [int(left - previous_right) for (_, previous_right), (left, _) in zip(glyph_runs, glyph_runs[1:])]
+		glyphs = np.stack([self.scale_glyph(footer[:, left:right]) for left, right in glyph_runs])
+		widths = [int(right - left) for left, right in glyph_runs]
+		return glyphs, widths, gaps
+
+	@staticmethod
+	def runs(mask):
+		"""(start, end) of every run of True values in a 1D mask."""
+		edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+		return list(zip(edges[0::2], edges[1::2]))
+
+	def scale_glyph(self, glyph):
+		# The font and its position are fixed, so glyphs are cut the full height of the footer and all scaled the same way
+		# (they keep their size and vertical position, e.g. "." vs "-"), then centered in a square
+		size = self.glyph_size
+		scale = size / glyph.shape[0]
+		width = min(max(int(round(glyph.shape[1] * scale)), 1), size)
+		glyph = cv2.resize(glyph, (width, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+		square = np.zeros((size, size), dtype=np.float32)
+		left = (size - width) // 2
+		square[:, left:left + width] = glyph
+		return square
+
+	def shifted_vectors(self, glyphs):
+		"""
+		Every glyph shifted by each of glyph_shifts, as vectors with zero mean and unit length
+		(so a dot product is the normalized cross-correlation). Shape: glyphs, shifts, pixels.
+		"""
+		shifted = np.stack([np.roll(glyphs, shift, axis=2) for shift in self.glyph_shifts], axis=1)
+		vectors = shifted.reshape(len(glyphs), len(self.glyph_shifts), -1)
+		vectors = vectors - vectors.mean(axis=2, keepdims=True)
+		return vectors / np.maximum(np.linalg.norm(vectors, axis=2, keepdims=True), 1e-6)
+
+	def learn(self, footer, text):
+		"""Learn glyph templates from a footer whose text is known. Returns False if the glyphs didn't line up with the text."""
+		characters = [character for character in text if not character.isspace()]
+		glyphs, widths, gaps = self.segment(footer)
+		if not characters or len(glyphs) != len(characters):
+			return False	# e.g. touching characters, can't tell which glyph is which
+		vectors = self.shifted_vectors(glyphs)
+		unshifted = self.glyph_shifts.index(0)
+
+		# Whether each character has a space before it, to learn how wide spaces are in pixels
+		space_before = []
+		after_space = False
+		for character in text.strip():
+			if character.isspace():
+				after_space = True
+			else:
+				space_before.append(after_space)
+				after_space = False
+		with self.lock:
+			for gap, is_space in zip(gaps[1:], space_before[1:]):
+				known_gaps = self.space_gaps if is_space else self.letter_gaps
+				known_gaps[:] = [min(known_gaps[0], gap), max(known_gaps[1], gap)] if known_gaps else [gap, gap]
+			for character, glyph_vectors, width in zip(characters, vectors, widths):
+				if character in self.glyph_sums:
+					# Added in the shift that lines up best with what has been learned so far (keeps the template sharp)
+					best_shift = np.argmax(glyph_vectors @ self.glyph_sums[character])
+					self.glyph_sums[character] += glyph_vectors[best_shift]
+					self.glyph_counts[character] += 1
+					self.width_sums[character] += width
+				else:
+					self.glyph_sums[character] = glyph_vectors[unshifted].copy()
+					self.glyph_counts[character] = 1
+					self.width_sums[character] = width
+			self.changed = True
+		return True
+
+	def read(self, footer):
+		"""Return the footer text, or None if any glyph isn't a confident match (then another engine should read it)."""
+		with self.lock:
+			if len(self.glyph_sums) < 2:
+				return None
+			characters = list(self.glyph_sums)
+			glyph_counts = np.array([self.glyph_counts[character] for character in characters])
+			space_gaps = list(self.space_gaps)
+			letter_gaps = list(self.letter_gaps)
+			templates = np.stack([self.glyph_sums[character] / self.glyph_counts[character] for character in characters])
+			template_widths = np.array([self.width_sums[character] / self.glyph_counts[character] for character in characters])
+		templates /= np.maximum(np.linalg.norm(templates, axis=1, keepdims=True), 1e-6)
+
+		glyphs, widths, gaps = self.segment(footer)
+		if len(glyphs) == 0:
+			return None
+
+		# Spaces are gaps closer to the learned space width than to the learned gaps between characters
+		if len(glyphs) > 1 and (not space_gaps or not letter_gaps or space_gaps[0] <= letter_gaps[1]):
+			return None		# Not learned yet (or can't be told apart)
+		space_threshold = (space_gaps[0] + letter_gaps[1]) / 2 if len(glyphs) > 1 else 0
+
+		# Correlation of every glyph (in every shift) with every template at once
+		scores = (self.shifted_vectors(glyphs) @ templates.T).max(axis=1)
+		best = np.argsort(scores, axis=1)[:, ::-1]
+		best_scores = scores[np.arange(len(glyphs)), best[:, 0]]
+		second_scores = scores[np.arange(len(glyphs)), best[:, 1]]
+		if best_scores.min() < self.minimum_score or (best_scores - second_scores).min() < self.minimum_margin:
+			return None
+
+		# A character seen only a few times may just be the closest of the characters learned so far
+		if glyph_counts[best[:, 0]].min() < self.minimum_count:
+			return None
+
+		# A glyph much wider or narrower than its character is probably two touching characters (e.g. "5,")
+		if np.abs(np.array(widths) - template_widths[best[:, 0]]).max() > 1.5:
+			return None
+
+		text = ""
+		for glyph_number, template_number in enumerate(best[:, 0]):
+			if glyph_number > 0 and gaps[glyph_number] > space_threshold:
+				text += " "
+			text += characters[template_number]
+		return text
+
+
+def read_cslo_footer_texts(image_paths, progress_callback=None, engine="template"):
+	"""
+	Read the footer text of each cSLO image, returning {image_path: text} (images that can't be read are left out).
+	Footers are decoded on several threads and read by EasyOCR in batches. Already read images come from FooterTextCache
+	(kept per engine, so choosing "EasyOCR only" reads again any footer that template matching read).
+	engine "template" reads footers with FooterGlyphTemplates first, and only the ones it isn't sure about with EasyOCR
+	(which it then learns from). progress_callback(number_done, total) is called as images are read.
+	"""
+	cache = FooterTextCache.shared()
+	texts = {}
+	image_paths_to_read = []
+	for image_path in image_paths:
+		cached_text = cache.get(image_path, "easyocr")
+		if cached_text is None and engine == "template":
+			cached_text = cache.get(image_path, "template")
+		if cached_text is None:
+			image_paths_to_read.append(image_path)
+		else:
+			texts[image_path] = cached_text
+
+	total = len(image_paths)
+	if progress_callback:
+		progress_callback(len(texts), total)
+	if not image_paths_to_read:
+		return texts
+
+	# Decoding just the footers, several at a time
+	with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+		footers = dict(zip(image_paths_to_read, executor.map(read_cslo_footer, image_paths_to_read)))
+
+	# Template matching takes milliseconds per footer, EasyOCR only gets what it couldn't read confidently
+	glyph_templates = FooterGlyphTemplates.shared() if engine == "template" else None
+	if glyph_templates is not None:
+		for image_path, footer in footers.items():
+			if footer is not None:
+				text = glyph_templates.read(footer)
+				if text is not None:
+					texts[image_path] = text
+					cache.set(image_path, text, "template")
+		if progress_callback:
+			progress_callback(len(texts), total)
+
+	# Footers of the same size (normally all of them) are read together in batches
+	footers_by_shape = collections.defaultdict(list)
+	for image_path, footer in footers.items():
+		if footer is not None and image_path not in texts:
+			footers_by_shape[footer.shape].append(image_path)
+	if not footers_by_shape:
+		cache.save()
+		return texts
+
+	reader = get_reader()
+	ocr_batch_size = 16
+	for shape, same_shape_image_paths in footers_by_shape.items():
+		for first in range(0, len(same_shape_image_paths), ocr_batch_size):
+			batch_image_paths = same_shape_image_paths[first:first + ocr_batch_size]
+			batch_footers = [footers[image_path] for image_path in batch_image_paths]
+			if len(batch_footers) > 1:
+				batch_results = reader.readtext_batched(batch_footers, batch_size=ocr_batch_size)
+			else:
+				batch_results = [reader.readtext(batch_footers[0])]
+
+			for image_path, results in zip(batch_image_paths, batch_results):
+				text = " ".join(res[1] for res in results)  # res[1] contains detected text
+				texts[image_path] = text
+				cache.set(image_path, text, "easyocr")
+
+				# Confident reads teach the template engine the footer font
+				if glyph_templates is not None and results and min(res[2] for res in results) >= 0.9:
+					glyph_templates.learn(footers[image_path], text)
+			if progress_callback:
+				progress_callback(len(texts), total)
+
+	cache.save()
+	if glyph_templates is not None:
+		glyph_templates.save()
+	return texts
+
+
+
 """
 ----------------------------------
 --- Find OCT retina boundaries ---
 ----------------------------------
 """
 
-def find_oct_retina_bounds(img):
-	"""Return the topmost and bottommost pixel positions of the retina."""
+def find_oct_retina_bounds(img, column_step=1):
+	"""
+	Return the topmost and bottommost pixel positions of the retina.
+	Same result as find_oct_retina_bounds_reference, without sorting every row: a row is bright if its
+	95th percentile is above the cutoff, which for most rows can be told by counting pixels at or below the cutoff.
+	column_step > 1 only looks at every column_step-th column (faster, approximate).
+	"""
+	# Convert to grayscale if needed
+	if img.ndim == 3:
+		img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+	if column_step > 1:
+		img = img[:, ::column_step]
+
+	# Compute adaptive threshold based on overall brightness (from a histogram for 8 bit images, which is one pass)
+	if img.dtype == np.uint8:
+		histogram = np.bincount(img.ravel(), minlength=256).astype(float)
+		values = np.arange(256, dtype=float)
+		mean = (histogram @ values) / img.size
+		std = math.sqrt(max((histogram @ (values * values)) / img.size - mean * mean, 0))
+	else:
+		mean = np.mean(img)
+		std = np.std(img)
+	cutoff = max(mean + std, 50)
+
+	# The 95th percentile of a row lies between its sorted values number low and high (linear interpolation)
+	row_length = img.shape[1]
+	low = int(math.floor(0.95 * (row_length - 1)))
+	high = min(low + 1, row_length - 1)
+	pixels_at_or_below_cutoff = np.count_nonzero(img <= cutoff, axis=1)
+	bright = pixels_at_or_below_cutoff <= low				# Both values above the cutoff
+	undecided = ~bright & (pixels_at_or_below_cutoff <= high)	# Cutoff between the two values (few rows)
+	if undecided.any():
+		bright[undecided] = np.percentile(img[undecided], 95, axis=1) > cutoff
+
+	# Find where the retina (bright region) exists
+	bright_rows = np.flatnonzero(bright)
+
+	if bright_rows.size == 0:
+		return img.shape[0], 0  # nothing bright enough found
+
+	# Return absolute top and bottom of the bright region
+	top = int(bright_rows.min())
+	bottom = int(bright_rows.max())
+	return top, bottom
+
+
+class RetinaBoundsCache(FileResultCache):
+	"""Retina bounds (top, bottom) of OCT images, in pixels of the image on disk. Shared by the dialog box and ImageCompilation."""
+	cache_file_path = os.path.join(cache_directory, "retina_bounds.json")
+
+
+def memory_map_oct_tiff(image_path, frame=0):
+	"""
+	Memory-map the pixels of an uncompressed 8 bit TIFF (one frame of it, for volumes), so rows are only read from disk when they are used.
+	Returns a read-only NumPy view (rows, columns) or (rows, columns, 3), or None if the file can't be mapped
+	this way (not a TIFF, compressed, other pixel formats, or tifffile isn't installed).
+	"""
+	if not image_path.lower().endswith((".tif", ".tiff")):
+		return None
+	try:
+		import tifffile		# Optional, only used for this
+	except ImportError:
+		return None
+
+	try:
+		with tifffile.TiffFile(image_path) as tif:
+			page = tif.pages[frame]
+			if (not page.is_memmappable or page.dtype != np.uint8
+					or page.photometric not in (tifffile.PHOTOMETRIC.MINISBLACK, tifffile.PHOTOMETRIC.RGB)):
+				return None
+		pixels = tifffile.memmap(image_path, page=frame, mode="r")
+	except (OSError, ValueError, IndexError, tifffile.TiffFileError):
+		return None
+
+	if pixels.ndim == 2 or (pixels.ndim == 3 and pixels.shape[2] == 3):
+		return pixels
+	return None
+
+
+class OctVolumeFrameCache(FileResultCache):
+	"""Frame chosen from each OCT volume by the "max_signal" rule (finding it reads the whole volume)."""
+	cache_file_path = os.path.join(cache_directory, "oct_volume_frames.json")
+
+
+def open_oct_frame(image_path, frame=0):
+	"""Open one frame of an OCT image. Only that frame is decoded (when it's loaded), not the whole volume."""
+	image = Image.open(image_path)
+	if frame:
+		image.seek(frame)
+	return image
+
+
+def oct_volume_frame_rule(frame_rules, image_type_name):
+	"""Frame rule of an OCT image type: from frame_rules (settings['oct_volume_frames']) if it has one, otherwise the default."""
+	return (frame_rules or {}).get(image_type_name, default_oct_volume_frame)
+
+
+def is_oct_volume_frame_rule(frame_rule):
+	"""Whether frame_rule is one that choose_oct_volume_frame understands: "center", "max_signal" or a frame number."""
+	if frame_rule in ("center", "max_signal"):
+		return True
+	if isinstance(frame_rule, str):
+		return frame_rule.strip().isdigit()
+	return isinstance(frame_rule, int) and not isinstance(frame_rule, bool) and frame_rule >= 0
+
+
+def choose_oct_volume_frame(image_path, frame_rule=default_oct_volume_frame, number_of_frames=None):
+	"""
+	Frame of an OCT image to use: 0 for single images, otherwise picked from the volume by frame_rule
+	("center", a frame number or "max_signal"). Volumes are named like any other OCT image (<mouse>_<eye>_<image type>).
+	number_of_frames is read from the image unless it is given (e.g. from ImageCatalog.image_header).
+	"""
+	if os.path.splitext(image_path)[1].lower() not in (".tif", ".tiff"):
+		return 0
+
+	if number_of_frames is None:
+		try:
+			with Image.open(image_path) as image:
+				number_of_frames = getattr(image, "n_frames", 1)	# Only reads the frame headers
+		except (OSError, UnidentifiedImageError):
+			return 0
+	if number_of_frames == 1:
+		return 0
+	if frame_rule == "center":
+		return number_of_frames // 2
+	if frame_rule != "max_signal":
+		return min(max(int(frame_rule), 0), number_of_frames - 1)
+
+	cache = OctVolumeFrameCache.shared()
+	frame = cache.get(image_path, frame_rule)
+	if frame is None:
+		frame = find_max_signal_frame(image_path, number_of_frames)
+		cache.set(image_path, frame, frame_rule)
+		cache.save()
+	return frame
+
+
+def find_max_signal_frame(image_path, number_of_frames):
+	"""Frame of a volume with the most retinal signal, judged by the mean brightness of every 4th row and column."""
+	signals = []
+	for frame in range(number_of_frames):
+		pixels = memory_map_oct_tiff(image_path, frame)
+		if pixels is None:
+			with open_oct_frame(image_path, frame) as image:
+				pixels = np.asarray(image.convert("L"))
+		signals.append(float(pixels[::4, ::4].mean()))
+		if frame % 50 == 0:
+			status(f"Finding the brightest B-scan of {os.path.basename(image_path)}: {frame}/{number_of_frames}")
+	return int(np.argmax(signals))
+
+
+def find_max_signal_frames(image_paths, numbers_of_frames=None):
+	"""
+	Find the "max_signal" frame of many OCT volumes at once and keep them in OctVolumeFrameCache, where
+	choose_oct_volume_frame finds them. Volumes that aren't in the cache are read on a pool of processes
+	(each whole volume is read once, frame by frame). numbers_of_frames: {image_path: number of frames}, if known.
+	"""
+	numbers_of_frames = numbers_of_frames or {}
+	cache = OctVolumeFrameCache.shared()
+	volumes_to_read = []
+	for image_path in dict.fromkeys(image_paths):
+		if os.path.splitext(image_path)[1].lower() not in (".tif", ".tiff") or cache.get(image_path, "max_signal") is not None:
+			continue
+		number_of_frames = numbers_of_frames.get(image_path)
+		if number_of_frames is None:
+			try:
+				with Image.open(image_path) as image:
+					number_of_frames = getattr(image, "n_frames", 1)
+			except (OSError, UnidentifiedImageError):
+				continue	# Left to choose_oct_volume_frame
+		if number_of_frames > 1:
+			volumes_to_read.append((image_path, number_of_frames))
+	if not volumes_to_read:
+		return
+
+	image_paths_to_read = [image_path for image_path, _ in volumes_to_read]
+	numbers_of_frames_to_read = [number_of_frames for _, number_of_frames in volumes_to_read]
+	if len(volumes_to_read) > 1:	# Each volume is read whole, so even two are worth starting processes for
+		status(f"Finding the brightest B-scan of {len(volumes_to_read)} OCT volumes")
+		# Fresh processes rather than forked ones (see find_retina_bounds_of_files)
+		with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as executor:
+			frames = list(executor.map(find_max_signal_frame, image_paths_to_read, numbers_of_frames_to_read))
+	else:
+		frames = [find_max_signal_frame(image_paths_to_read[0], numbers_of_frames_to_read[0])]
+
+	for image_path, frame in zip(image_paths_to_read, frames):
+		cache.set(image_path, frame, "max_signal")
+	cache.save()
+
+
+def find_retina_bounds_of_file(image_path, column_step=1, frame=0):
+	"""Retina bounds of an image file, read the same way as the image that crop_oct_image is given (None if unreadable)."""
+	img = memory_map_oct_tiff(image_path, frame)
+	if img is None:
+		try:
+			with open_oct_frame(image_path, frame) as image:
+				img = np.array(image)
+		except (OSError, UnidentifiedImageError, EOFError):
+			return None
+	if img.ndim == 3:
+		img = cv2.cvtColor(img, cv2.COLOR_RGBA2GRAY if img.shape[2] == 4 else cv2.COLOR_RGB2GRAY)
+	return find_oct_retina_bounds(img, column_step)
+
+
+def find_retina_bounds_of_files(image_paths, column_step=1, frames=None):
+	"""
+	Retina bounds of many OCT images, returning {image_path: (top, bottom)} (unreadable images are left out).
+	frames: {image_path: frame} for OCT volumes (frame 0 for anything not in it).
+	Bounds already found come from RetinaBoundsCache, the others are found on a pool of processes.
+	"""
+	frames = frames or {}
+	cache = RetinaBoundsCache.shared()
+	bounds = {}
+	image_paths_to_read = []
+	for image_path in image_paths:
+		cached_bounds = cache.get(image_path, f"{column_step}|{frames.get(image_path, 0)}")
+		if cached_bounds is None:
+			image_paths_to_read.append(image_path)
+		else:
+			bounds[image_path] = tuple(cached_bounds)
+
+	if len(image_paths_to_read) > 4:	# Starting processes isn't worth it for a handful of images
+		status(f"Finding retina bounds of {len(image_paths_to_read)} OCT images")
+		# Fresh processes rather than forked ones: a fork copies locks that background threads (imports, EasyOCR) may be holding
+		with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as executor:
+			chunksize = max(len(image_paths_to_read) // ((os.cpu_count() or 1) * 4), 1)
+			new_bounds = executor.map(find_retina_bounds_of_file, image_paths_to_read, itertools.repeat(column_step),
+							 [frames.get(image_path, 0) for image_path in image_paths_to_read], chunksize=chunksize)
+			new_bounds = list(new_bounds)
+	else:
+		new_bounds = [find_retina_bounds_of_file(image_path, column_step, frames.get(image_path, 0))
+				for image_path in image_paths_to_read]
+
+	for image_path, image_bounds in zip(image_paths_to_read, new_bounds):
+		if image_bounds is not None:
+			bounds[image_path] = image_bounds
+			cache.set(image_path, list(image_bounds), f"{column_step}|{frames.get(image_path, 0)}")
+
+	cache.save()
+	return bounds
+
+
+def find_oct_retina_bounds_reference(img):
+	"""Return the topmost and bottommost pixel positions of the retina (original implementation, for comparisons)."""
 	# Convert to grayscale if needed
 	if img.ndim == 3:
 		img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -1532,6 +3054,319 @@ def find_oct_retina_bounds(img):
 	return top, bottom
 
 
+def compare_retina_bounds(image_paths, column_step=1, tolerance=2):
+	"""
+	Check find_oct_retina_bounds against find_oct_retina_bounds_reference on real scans.
+	Returns the scans whose top or bottom differ by more than tolerance pixels, as (path, fast bounds, reference bounds).
+	"""
+	differences = []
+	fast_time, reference_time = 0.0, 0.0
+	for image_path in image_paths:
+		img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+		if img is None:
+			continue
+
+		start = time.perf_counter()
+		fast_bounds = find_oct_retina_bounds(img, column_step)
+		fast_time += time.perf_counter() - start
+		start = time.perf_counter()
+		reference_bounds = find_oct_retina_bounds_reference(img)
+		reference_time += time.perf_counter() - start
+
+		if max(abs(fast_bounds[0] - reference_bounds[0]), abs(fast_bounds[1] - reference_bounds[1])) > tolerance:
+			differences.append((image_path, fast_bounds, reference_bounds))
+
+	print(f"{len(image_paths)} scans: {len(differences)} differ by more than {tolerance} px "
+		  f"({fast_time:.2f} s vs {reference_time:.2f} s for the original)")
+	for image_path, fast_bounds, reference_bounds in differences:
+		print(f"\t{image_path}: {fast_bounds} vs {reference_bounds}")
+	return differences
+
+
+
+"""
+------------------------------
+--- Streaming file writers ---
+------------------------------
+"""
+
+class StreamingPngWriter:
+	"""
+	Writes an RGB PNG file a strip of rows at a time, so the whole image never has to be in memory
+	(PIL can only save an image that is completely in memory).
+	"""
+	def __init__(self, file_path, width, height, compression_level=6):
+		self.width = width
+		self.height = height
+		self.rows_written = 0
+		self.compressor = zlib.compressobj(compression_level)
+		self.file = open(file_path, "wb")
+		self.file.write(b"\x89PNG\r\n\x1a\n")
+		self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))	# 8 bit RGB
+
+	def write_chunk(self, chunk_type, data):
+		self.file.write(struct.pack(">I", len(data)) + chunk_type + data)
+		self.file.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+	def write_rows(self, strip):
+		"""Append the rows of an RGB image that is as wide as the PNG."""
+		if strip.width != self.width or self.rows_written + strip.height > self.height:
+			raise ValueError("Strip doesn't fit in the PNG")
+
+		# "Sub" filter (difference with the pixel to the left), which compresses much better than raw pixels
+		pixels = np.asarray(strip.convert("RGB")).reshape(strip.height, self.width * 3)
+		filtered = np.empty((strip.height, self.width * 3 + 1), dtype=np.uint8)
+		filtered[:, 0] = 1
+		filtered[:, 1:4] = pixels[:, :3]
+		np.subtract(pixels[:, 3:], pixels[:, :-3], out=filtered[:, 4:])
+
+		self.write_compressed(filtered.tobytes())
+		self.rows_written += strip.height
+
+	def write_blank_rows(self, number_of_rows, color):
+		"""Append rows that are all one color (e.g. margins)."""
+		row = np.zeros(self.width * 3 + 1, dtype=np.uint8)
+		row[0] = 1
+		row[1:4] = color
+		row_bytes = row.tobytes()
+		rows_left = number_of_rows
+		while rows_left > 0:
+			rows_at_once = min(rows_left, 256)
+			self.write_compressed(row_bytes * rows_at_once)
+			rows_left -= rows_at_once
+		self.rows_written += max(number_of_rows, 0)
+
+	def write_compressed(self, data):
+		compressed = self.compressor.compress(data)
+		if compressed:
+			self.write_chunk(b"IDAT", compressed)
+
+	def close(self):
+		if self.file.closed:
+			return
+		try:
+			if self.rows_written == self.height:
+				self.write_chunk(b"IDAT", self.compressor.flush())
+				self.write_chunk(b"IEND", b"")
+		finally:
+			self.file.close()
+
+
+
+class DeepZoomWriter:
+	"""
+	Writes a Deep Zoom (DZI) tile pyramid a strip of rows at a time, plus a small HTML page to browse it.
+	Only the visible tiles are loaded by the viewer, so even a huge compilation opens instantly.
+	Files: <name>.dzi, <name>_files/<level>/<column>_<row>.jpg and <name>.html
+	"""
+	def __init__(self, file_path, width, height, tile_size=256, tile_format="jpg", quality=90):
+		self.width = width
+		self.height = height
+		self.tile_size = tile_size
+		self.tile_format = tile_format
+		self.quality = quality
+		self.rows_written = 0
+		self.base_path = os.path.splitext(file_path)[0]
+		self.name = os.path.basename(self.base_path)
+		self.tiles_directory = self.base_path + "_files"
+
+		# Level max_level is full size, each level below is half the size of the one above (down to 1x1 pixel)
+		self.max_level = math.ceil(math.log2(max(width, height, 1)))
+		self.pending_rows = {}			# Rows of each level that don't make a full row of tiles yet
+		self.tile_rows_written = {}
+		for level in range(self.max_level + 1):
+			self.pending_rows[level] = None
+			self.tile_rows_written[level] = 0
+			os.makedirs(os.path.join(self.tiles_directory, str(level)), exist_ok=True)
+
+	def write_rows(self, strip):
+		"""Append the rows of an RGB image that is as wide as the document."""
+		if strip.width != self.width or self.rows_written + strip.height > self.height:
+			raise ValueError("Strip doesn't fit in the pyramid")
+		self.add_rows(self.max_level, strip.convert("RGB"))
+		self.rows_written += strip.height
+
+	def write_blank_rows(self, number_of_rows, color):
+		"""Append rows that are all one color (e.g. margins)."""
+		rows_left = number_of_rows
+		while rows_left > 0:
+			rows_at_once = min(rows_left, self.tile_size)
+			self.write_rows(Image.new("RGB", (self.width, rows_at_once), tuple(color)))
+			rows_left -= rows_at_once
+
+	def add_rows(self, level, band):
+		pending = self.pending_rows[level]
+		if pending is not None:
+			combined = Image.new("RGB", (band.width, pending.height + band.height))
+			combined.paste(pending, (0, 0))
+			combined.paste(band, (0, pending.height))
+			band = combined
+
+		# Writing every full row of tiles
+		top = 0
+		while band.height - top >= self.tile_size:
+			self.write_tile_row(level, band.crop((0, top, band.width, top + self.tile_size)))
+			top += self.tile_size
+		self.pending_rows[level] = band.crop((0, top, band.width, band.height)) if top < band.height else None
+
+	def write_tile_row(self, level, band):
+		row = self.tile_rows_written[level]
+		for column in range(math.ceil(band.width / self.tile_size)):
+			left = column * self.tile_size
+			tile = band.crop((left, 0, min(left + self.tile_size, band.width), band.height))
+			tile_path = os.path.join(self.tiles_directory, str(level), f"{column}_{row}.{self.tile_format}")
+			tile.save(tile_path, quality=self.quality)
+		self.tile_rows_written[level] += 1
+
+		# Each row of tiles becomes half a row of tiles on the level below (box filter, so no seams between rows)
+		if level > 0:
+			self.add_rows(level - 1, band.reduce(2))
+
+	def close(self):
+		if self.rows_written != self.height:
+			return
+
+		# Last (partial) row of tiles of each level, from the full size level down
+		for level in range(self.max_level, -1, -1):
+			pending = self.pending_rows[level]
+			if pending is not None:
+				self.pending_rows[level] = None
+				self.write_tile_row(level, pending)
+
+		with open(self.base_path + ".dzi", "w") as file:
+			file.write(
+				'<?xml version="1.0" encoding="UTF-8"?>\n'
+				f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{self.tile_format}" '
+				f'Overlap="0" TileSize="{self.tile_size}">\n'
+				f'\t<Size Width="{self.width}" Height="{self.height}"/>\n'
+				'</Image>\n'
+			)
+
+		viewer_settings = {
+			"width": self.width,
+			"height": self.height,
+			"tileSize": self.tile_size,
+			"maxLevel": self.max_level,
+			"format": self.tile_format,
+			"tilesUrl": self.name + "_files"
+		}
+		with open(self.html_path, "w") as file:
+			file.write(deep_zoom_viewer_html.replace("{{title}}", self.name).replace("{{settings}}", json.dumps(viewer_settings)))
+
+	@property
+	def html_path(self):
+		return self.base_path + ".html"
+
+
+deep_zoom_viewer_html = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{{title}}</title>
+<style>
+	html, body { margin: 0; height: 100%; overflow: hidden; background: #0f0f0f; }
+	canvas { display: block; cursor: grab; }
+	#help { position: fixed; bottom: 8px; left: 8px; color: #888; font: 12px sans-serif; }
+</style>
+</head>
+<body>
+<canvas id="viewer"></canvas>
+<div id="help">Drag to pan, scroll to zoom, double click to fit</div>
+<script>
+const pyramid = {{settings}};
+const canvas = document.getElementById("viewer");
+const context = canvas.getContext("2d");
+const tiles = new Map();
+let scale = 1, offsetX = 0, offsetY = 0;	// Screen pixels per document pixel, document pixel at the top left corner
+
+function fit() {
+	scale = Math.min(canvas.width / pyramid.width, canvas.height / pyramid.height);
+	offsetX = (pyramid.width - canvas.width / scale) / 2;
+	offsetY = (pyramid.height - canvas.height / scale) / 2;
+}
+
+function getTile(level, column, row) {
+	const key = level + "/" + column + "_" + row;
+	let tile = tiles.get(key);
+	if (!tile) {
+		tile = new Image();
+		tile.onload = draw;
+		tile.src = pyramid.tilesUrl + "/" + key + "." + pyramid.format;
+		tiles.set(key, tile);
+	}
+	return tile;
+}
+
+function drawLevel(level, loadMissing) {
+	const levelScale = Math.pow(2, level - pyramid.maxLevel);	// Level pixels per document pixel
+	const tileSpan = pyramid.tileSize / levelScale;				// Document pixels per tile
+	const columns = Math.ceil(pyramid.width * levelScale / pyramid.tileSize);
+	const rows = Math.ceil(pyramid.height * levelScale / pyramid.tileSize);
+	const firstColumn = Math.max(Math.floor(offsetX / tileSpan), 0);
+	const firstRow = Math.max(Math.floor(offsetY / tileSpan), 0);
+	const lastColumn = Math.min(Math.floor((offsetX + canvas.width / scale) / tileSpan), columns - 1);
+	const lastRow = Math.min(Math.floor((offsetY + canvas.height / scale) / tileSpan), rows - 1);
+	for (let row = firstRow; row <= lastRow; row++) {
+		for (let column = firstColumn; column <= lastColumn; column++) {
+			const key = level + "/" + column + "_" + row;
+			const tile = loadMissing ? getTile(level, column, row) : tiles.get(key);
+			if (tile && tile.complete && tile.naturalWidth) {
+				context.drawImage(tile,
+					(column * tileSpan - offsetX) * scale, (row * tileSpan - offsetY) * scale,
+					tile.naturalWidth / levelScale * scale, tile.naturalHeight / levelScale * scale);
+			}
+		}
+	}
+}
+
+function draw() {
+	context.fillStyle = "#0f0f0f";
+	context.fillRect(0, 0, canvas.width, canvas.height);
+	const level = Math.min(Math.max(pyramid.maxLevel + Math.ceil(Math.log2(scale)), 0), pyramid.maxLevel);
+	for (let coarser = Math.max(level - 4, 0); coarser < level; coarser++) {
+		drawLevel(coarser, false);	// Already loaded coarser tiles fill in while the sharp ones load
+	}
+	drawLevel(level, true);
+}
+
+function resize() {
+	canvas.width = window.innerWidth;
+	canvas.height = window.innerHeight;
+	draw();
+}
+
+let dragging = null;
+canvas.addEventListener("mousedown", event => { dragging = [event.clientX, event.clientY]; canvas.style.cursor = "grabbing"; });
+window.addEventListener("mouseup", () => { dragging = null; canvas.style.cursor = "grab"; });
+window.addEventListener("mousemove", event => {
+	if (!dragging) return;
+	offsetX -= (event.clientX - dragging[0]) / scale;
+	offsetY -= (event.clientY - dragging[1]) / scale;
+	dragging = [event.clientX, event.clientY];
+	draw();
+});
+canvas.addEventListener("wheel", event => {
+	event.preventDefault();
+	const zoom = Math.exp(-event.deltaY * 0.002);
+	const x = offsetX + event.clientX / scale, y = offsetY + event.clientY / scale;
+	scale *= zoom;
+	offsetX = x - event.clientX / scale;
+	offsetY = y - event.clientY / scale;
+	draw();
+}, { passive: false });
+canvas.addEventListener("dblclick", () => { fit(); draw(); });
+window.addEventListener("resize", resize);
+
+canvas.width = window.innerWidth;
+canvas.height = window.innerHeight;
+fit();
+draw();
+</script>
+</body>
+</html>
+"""
+
+
 
 """
 ---------------------------------
@@ -1540,10 +3375,26 @@ def find_oct_retina_bounds(img):
 """
 
 class ImageCompilation:
-	def __init__(self, settings=None, mode="full"):
+	def __init__(self, settings=None, mode="full", headless=False):
 		self.settings = settings or {}
 		self.mode = mode
+		self.headless = headless	# No dialog boxes and the final document isn't opened (batch mode)
 		self.mouse_image_list = {}
+		self.selected_image_paths = {}		# (mouse, eye, imager, modality) -> path chosen by the user for [select] image types
+		self.font_lock = threading.Lock()	# FreeType fonts are shared between threads when mice are rendered in parallel
+		self.mouse_executor = None			# Threads that render mouse canvases (parallel_workers setting)
+		self.prefetch_executor = None		# Threads that decode upcoming images while the current one is pasted
+		self.saved_file_path = None			# Where the compilation document was written
+		self.retina_bounds = {}				# OCT image path -> (top, bottom), found before the tiles are drawn
+		self.oct_frames = {}				# OCT image path -> frame to use (OCT volumes have more than one)
+		self.tile_cache = None				# Processed tiles kept on disk (tile_cache setting, on unless set to False)
+		if self.settings.get('tile_cache', True):
+			self.tile_cache = TileCache(int(self.settings.get('tile_cache_size_mb', 2048)) * 1024 * 1024)
+		# Mouse grids are only kept for the settings dialog box session (previews, then the final run),
+		# and not when streaming strips, where the memory use should stay constant
+		self.reuse_mouse_grids = not headless
+		self.number_of_mice_rendered = 0
+		self.progress_lock = threading.Lock()	# Pages can be rendered at the same time, each counting the mice it drew
 
 		# Creating dictionary of mouse numbers
 		# This will be filled in with file paths in the build_mouse_image_list() function
@@ -1559,32 +3410,25 @@ class ImageCompilation:
 		original_images_to_use = self.settings.get('images_to_use', [])
 		self.image_type_objects = [self.ImageType.from_tuple(t) for t in original_images_to_use]
 
+		# Images may have been added since the directories were scanned for the dialog box
+		# (cheap, only folders whose mtime changed are listed again)
+		for directory, imager in self.settings['directories']:
+			DirectoryScan.for_directory(directory, imager, rescan=True)
+		self.image_catalogs = [ImageCatalog.for_directory(directory) for directory, _ in self.settings['directories']]
+
 		# -- Determining cslo and oct image sizes and assigning images as examples --
 		# First cslo images
 		self.cslo_width = 0
 		self.cslo_height = 0
 		for directory, imager in self.settings['directories']:
 			if imager == "cslo" and not hasattr(self, "example_cslo_image"):
-				# Get the first subdirectory in the root
-				first_subdir = next(
-					os.path.join(directory, d)
-					for d in os.listdir(directory)
-					if os.path.isdir(os.path.join(directory, d))
+				# Get the first image of the first mouse
+				scan = DirectoryScan.for_directory(directory, "cslo")
+				example_path = next(
+					scan.first_cslo_image_path(mouse)
+					for mouse in scan.cslo_image_paths
+					if scan.first_cslo_image_path(mouse) is not None
 				)
-				# Get the first subdirectory inside that, which should be "OD" or "OS"
-				second_subdir = next(
-					os.path.join(first_subdir, d)
-					for d in os.listdir(first_subdir)
-					if os.path.isdir(os.path.join(first_subdir, d)) and d in {"OD", "OS"}
-				)
-				directory = second_subdir
-
-				files = [
-					f for f in os.listdir(directory)
-					if os.path.splitext(f)[1].lower() in image_extensions
-				]
-
-				example_path = os.path.join(directory, files[0])
 				try:
 					self.example_cslo_image = Image.open(example_path)
 					self.cslo_width, self.cslo_height = self.example_cslo_image.size
@@ -1606,12 +3450,7 @@ class ImageCompilation:
 		self.oct_height = 0
 		for directory, imager in self.settings['directories']:
 			if imager == "oct" and not hasattr(self, "example_oct_image"):
-				files = [
-					f for f in os.listdir(directory)
-					if os.path.splitext(f)[1].lower() in image_extensions
-				]
-
-				example_path = os.path.join(directory, files[0])
+				example_path = DirectoryScan.for_directory(directory, "oct").oct_image_paths[0]
 				try:
 					self.example_oct_image = Image.open(example_path)
 					self.oct_width, self.oct_height = self.example_oct_image.size
@@ -1757,31 +3596,19 @@ class ImageCompilation:
 			# Creating a list of file paths for cSLO images
 			cslo_image_file_paths = []
 			for directory in cslo_directories:
-				mice = [f for f in os.listdir(directory) if os.path.isdir(os.path.join(directory, f))]
-				mice_directories = []
+				scan = DirectoryScan.for_directory(directory, "cslo")
 				
 				# Excluding any mice that the user may have manually removed
-				for mouse in mice:
+				for mouse, eye_image_paths in scan.cslo_image_paths.items():
 					if mouse in self.settings["mouse_info_dic"]:
-						mice_directories.append(os.path.join(directory, mouse))
-				
-				for mouse_directory in mice_directories:
-					for root, dirs, files in os.walk(mouse_directory):	# recursively walk all subfolders
-						folder_name = os.path.basename(root)
-						if folder_name in ("OD", "OS"):
-							for f in files:
-								if f.lower().endswith(tuple(image_extensions)):
-									cslo_image_file_paths.append(os.path.join(root, f))
+						cslo_image_file_paths.extend(eye_image_paths["OD"] + eye_image_paths["OS"])
 			
 			# Creating a list of file paths for OCT images
 			oct_image_file_paths = []
 			for directory in oct_directories:
-				potential_oct_image_files = [f for f in os.listdir(directory)
-							if f.lower().endswith(tuple(image_extensions))]
-				
-				for file in potential_oct_image_files:
-					if file.split("_")[0] in self.settings["mouse_info_dic"]:
-						oct_image_file_paths.append(os.path.join(directory, file))
+				for path in DirectoryScan.for_directory(directory, "oct").oct_image_paths:
+					if os.path.basename(path).split("_")[0] in self.settings["mouse_info_dic"]:
+						oct_image_file_paths.append(path)
 			
 
 			return cslo_image_file_paths, oct_image_file_paths
@@ -1825,68 +3652,80 @@ class ImageCompilation:
 
 
 	# ====================================================
-	# IMAGE ASSEMBLY
+	# IMAGE SELECTION
 	# ====================================================
-	def assemble_mouse_image_grid(self, mouse_id, mouse_grid_mode="Normal"):
-		"""Creates image compilation and metadata for one mouse"""
-		def crop_cslo_image(image):
-			# Crops the text off of the bottom of the image
-			width, height = image.size
-			cropped_image = image.crop((0, 0, width, width))
-
-			return cropped_image
-		
-		def crop_oct_image(image):
-			desired_oct_height = int(self.settings['oct_height'])
-
-			# Case 1: Already correct height
-			if image.height == desired_oct_height:
-				return image
-			
-			# Determine where the center of the retina is
-			# Convert PIL → NumPy
-			img = np.array(image)
-			if img.ndim == 3:
-				# Normalize color channel order to BGR for OpenCV
-				if img.shape[2] == 4:
-					img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
-				else:
-					img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-			
-			top_of_retina, bottom_of_retina = find_oct_retina_bounds(img)
-			center_of_retina = (top_of_retina + bottom_of_retina) // 2
-
-			# Case 2: Crop if taller
-			if image.height > desired_oct_height:
-				half_height = desired_oct_height // 2
-				top_crop = max(center_of_retina - half_height, 0)
-				bottom_crop = top_crop + desired_oct_height
-
-				# Adjust if bottom exceeds bounds
-				if bottom_crop > image.height:
-					bottom_crop = image.height
-					top_crop = bottom_crop - desired_oct_height
-
-				return image.crop((0, top_crop, image.width, bottom_crop))
-
-			# Case 3: Pad if shorter
-			new_img = Image.new("RGB", (image.width, desired_oct_height), color="black")
-			y_offset = (desired_oct_height - image.height) // 2
-			new_img.paste(image, (0, y_offset))
-			return new_img
-			
-			
+	def mice_in_layout_order(self):
+		"""Mouse numbers in the order they are placed in the compilation document."""
+		group_order = self.settings['group_order']
+		if group_order:
+			return [
+				mouse
+				for group in group_order
+				for mouse, mouse_info in self.settings['mouse_info_dic'].items()
+				if mouse_info[1] == group
+			]
+		return list(self.settings['mouse_info_dic'].keys())
+
+	def find_image_paths_with_modality(self, mouse_id, eye, image_modality):
+		"""All image paths of one mouse eye with the modality of interest, sorted by image number."""
+		image_paths_with_same_modality = []
+		for image_path in self.mouse_image_list[mouse_id][eye][image_modality.imager]:
+			_, image_number, _, _, modality = self.convert_path_to_base_name_and_parts(image_path, image_modality.imager)
+			if modality == image_modality.image_type_name:
+				image_paths_with_same_modality.append((int(image_number), image_path))
+		image_paths_with_same_modality.sort(key=lambda x: x[0])	# Sorting the list by image_number
+		return [x[1] for x in image_paths_with_same_modality]	# Making the list just image_path
+
+	def choose_image_path(self, mouse_id, eye, image_modality):
+		"""Return the image path to use for one mouse eye and image type (None if there isn't one)."""
+		available_image_paths = self.mouse_image_list[mouse_id][eye][image_modality.imager]	# All paths for that imager and eye
+
+		only_one_image_exists = not image_modality.select_required and image_modality.multiple_index is None
+		# If there aren't any images from that imager (cslo/oct)
+		if not available_image_paths:
+			return None
 
-		def user_choose_which_images_to_use(image_path_list, title):
-			def image_click(image_path):
-				root.destroy()
-				root.selected_image = image_path
+		# If the modality shouldn't have multiple images and thus just needs to grab the image that has the correct modality
+		if only_one_image_exists:
+			for image_path in available_image_paths:
+				_, _, _, _, modality = self.convert_path_to_base_name_and_parts(image_path, image_modality.imager)
+				if modality == image_modality.image_type_name:
+					return image_path
+			return None
 
-			def select_none(event=None):
-				root.destroy()
-				root.selected_image = None
+		# If we just need to grab the nth image with that modality
+		if image_modality.multiple_index is not None:
+			# Grab the image with the correct index, unless it can't, then don't use any image
+			try:
+				return self.find_image_paths_with_modality(mouse_id, eye, image_modality)[image_modality.multiple_index]
+			except IndexError:
+				return None
+
+		# If the user needed to select the image (chosen beforehand in resolve_image_selections)
+		return self.selected_image_paths.get((mouse_id, eye, image_modality.imager, image_modality.image_type_name))
+
+	def resolve_image_selections(self):
+		"""Ask the user to choose the image for every [select] image type before anything is rendered."""
+		def choose_images_in_one_window(pending_choices):
+			"""
+			One window for all of the [select] choices, showing the candidates of one choice at a time.
+			Clicking an image (or "Select none") chooses it and moves on to the next unanswered choice,
+			and Previous/Next (or the arrow keys) move between choices. The window closes once every choice is made.
+			pending_choices: [(selection_key, title, image_paths)]. Returns {selection_key: chosen path or None}.
+			"""
+			prefetch_ahead = 3				# Thumbnails of this many upcoming choices are loaded ahead of the current one
+			chosen = {}						# choice index -> chosen path (None for "Select none")
+			photos = {}						# (choice index, candidate index) -> PhotoImage
+			requested = set()				# (choice index, candidate index) already given to the loader
+			state = {"cursor": 0}
+			state_lock = threading.Lock()
+			cursor_moved = threading.Event()
+			stop_loading = threading.Event()
+			loaded_thumbnails = queue.Queue()
+			image_labels = []
 
 			def on_close_window(event=None):
+				stop_loading.set()
 				root.destroy()
 				exit()
 
@@ -1900,105 +3739,565 @@ class ImageCompilation:
 				y_coordinate = (screen_height - height) // 2
 				window.geometry(f"{width}x{height}+{x_coordinate}+{y_coordinate}")
 
+			def thumbnail_layout(image_path_list):
+				# Determine a uniform size based on first image (only its header is read)
+				with Image.open(image_path_list[0]) as sample_image:
+					uniform_width = int(sample_image.width * 0.5)
+					uniform_height = int(sample_image.height * 0.5)
+
+				# Determining the size and grid layout of the images
+				max_col_count = usable_screen_width // uniform_width
+				max_row_count = usable_screen_height // uniform_height
+				squares_needed = len(image_path_list)+1
+				while squares_needed > (max_col_count * max_row_count):
+					uniform_width = int(uniform_width * 0.95)
+					uniform_height = int(uniform_height * 0.95)
+					max_col_count = int(usable_screen_width // uniform_width)
+					max_row_count = usable_screen_height // uniform_height
+				return (uniform_width, uniform_height), max_col_count
+
+			def layout_of(choice_index):
+				# Worked out when a choice is first needed (mostly on the loader thread), then kept
+				with layouts_lock:
+					if choice_index not in thumbnail_layouts:
+						thumbnail_layouts[choice_index] = thumbnail_layout(pending_choices[choice_index][2])
+					return thumbnail_layouts[choice_index]
+
+			def load_thumbnails():
+				# Runs on a background thread: the thumbnails of the current choice first, then the next few choices
+				while not stop_loading.is_set():
+					next_thumbnail = None
+					with state_lock:
+						cursor = state["cursor"]
+						for choice_index in range(cursor, min(cursor + prefetch_ahead + 1, len(pending_choices))):
+							for candidate_index, path in enumerate(pending_choices[choice_index][2]):
+								if (choice_index, candidate_index) not in requested:
+									requested.add((choice_index, candidate_index))
+									next_thumbnail = (choice_index, candidate_index, path)
+									break
+							if next_thumbnail:
+								break
+					if next_thumbnail is None:
+						cursor_moved.wait(0.5)
+						cursor_moved.clear()
+						continue
+
+					choice_index, candidate_index, path = next_thumbnail
+					try:
+						thumbnail = load_thumbnail(path, layout_of(choice_index)[0])
+					except (OSError, UnidentifiedImageError):
+						continue
+					loaded_thumbnails.put((choice_index, candidate_index, thumbnail))
+
+			def show_loaded_thumbnails():
+				# PhotoImages can only be made on the tkinter thread
+				if stop_loading.is_set():
+					return
+				while not loaded_thumbnails.empty():
+					choice_index, candidate_index, thumbnail = loaded_thumbnails.get()
+					if not state["cursor"] - 1 <= choice_index <= state["cursor"] + prefetch_ahead:
+						with state_lock:
+							requested.discard((choice_index, candidate_index))	# Moved away since, loaded again if needed
+						continue
+					photos[(choice_index, candidate_index)] = ImageTk.PhotoImage(thumbnail)
+					if choice_index == state["cursor"]:
+						image_labels[candidate_index].config(image=photos[(choice_index, candidate_index)])
+				root.after(30, show_loaded_thumbnails)
+
+			def move_to(choice_index):
+				if not 0 <= choice_index < len(pending_choices):
+					return
+				with state_lock:
+					state["cursor"] = choice_index
+					# Only keeping the thumbnails of the choices around the current one
+					for key in list(photos):
+						if not choice_index - 1 <= key[0] <= choice_index + prefetch_ahead:
+							del photos[key]
+							requested.discard(key)
+				cursor_moved.set()
+				show_choice()
+
+			def choose(image_path):
+				chosen[state["cursor"]] = image_path
+				unanswered = [index for index in range(len(pending_choices)) if index not in chosen]
+				if not unanswered:
+					stop_loading.set()
+					root.destroy()
+					return
+				later_unanswered = [index for index in unanswered if index > state["cursor"]]
+				move_to(later_unanswered[0] if later_unanswered else unanswered[0])
+
+			def show_choice():
+				cursor = state["cursor"]
+				_, title, image_path_list = pending_choices[cursor]
+				(uniform_width, uniform_height), max_col_count = layout_of(cursor)
+				title_label.config(text=f"{title}    ({cursor + 1} of {len(pending_choices)})")
+				progress_bar["value"] = len(chosen)
+				previous_button.config(state="normal" if cursor > 0 else "disabled")
+				next_button.config(state="normal" if cursor < len(pending_choices) - 1 else "disabled")
+
+				for widget in grid_frame.winfo_children():
+					widget.destroy()
+				image_labels.clear()
+
+				# Black boxes where the images go until their thumbnails are loaded, the current choice is outlined
+				blank_photo = ImageTk.PhotoImage(Image.new("RGB", (uniform_width, uniform_height)))
+				row, col = 0, 0
+				for candidate_index, path in enumerate(image_path_list):
+					photo = photos.get((cursor, candidate_index), blank_photo)
+					outline_color = "yellow" if chosen.get(cursor, "") == path else "black"
+					label = tk.Label(grid_frame, image=photo, bg="black", highlightthickness=3,
+								highlightbackground=outline_color)
+					label.blank_photo = blank_photo
+					label.grid(row=row, column=col, padx=0, pady=0)
+					label.bind("<Button-1>", lambda event, image_path=path: choose(image_path))
+					image_labels.append(label)
+					col += 1
+					if col == max_col_count:
+						row += 1
+						col = 0
+
+				# Add the "Select none" box
+				outline_color = "yellow" if cursor in chosen and chosen[cursor] is None else "black"
+				none_canvas = tk.Canvas(grid_frame, width=uniform_width, height=uniform_height, bg="black",
+							highlightthickness=3, highlightbackground=outline_color)
+				none_canvas.create_text(
+					uniform_width // 2,
+					uniform_height // 2,
+					text="Select none",
+					fill="white",
+					font=("Arial", 14)
+				)
+				none_canvas.grid(row=row, column=col, padx=0, pady=0)
+				none_canvas.bind("<Button-1>", lambda event: choose(None))
+
 
 			# Root window
 			if tk._default_root is None:
 				root = tk.Tk()
 			else:
 				root = tk.Toplevel()
-			root.title(title)
+			root.title("Choose images")
 			root.protocol("WM_DELETE_WINDOW", on_close_window)
 			root.config(bg="black")
 
-			# Keep references to images
-			resized_images = []
-
-			# Determine a uniform size based on first image
-			sample_image = Image.open(image_path_list[0])
-			uniform_width = int(sample_image.width * 0.5)
-			uniform_height = int(sample_image.height * 0.5)
-			
-			# Determining the size and grid layout of the images
 			usable_screen_width = int(root.winfo_screenwidth()*0.95)
-			usable_screen_height = int(root.winfo_screenheight()*0.95)
-			max_col_count = usable_screen_width // uniform_width
-			max_row_count = usable_screen_height // uniform_height
-			squares_needed = len(image_path_list)+1
-			while squares_needed > (max_col_count * max_row_count):
-				uniform_width = int(uniform_width * 0.95)
-				uniform_height = int(uniform_height * 0.95)
-				max_col_count = int(usable_screen_width // uniform_width)
-				max_row_count = usable_screen_height // uniform_height
-			
-
-			# Load and display images
-			row, col = 0, 0
-			for path in image_path_list:
-				original_image = Image.open(path)
-				resized_image = original_image.resize((uniform_width, uniform_height))
-				photo = ImageTk.PhotoImage(resized_image)
-				resized_images.append(photo)
-				label = tk.Label(root, image=photo)
-				label.image = photo
-				label.grid(row=row, column=col, padx=0, pady=0)
-				label.bind("<Button-1>", lambda event, image_path=path: image_click(image_path))
-				col += 1
-				if col == max_col_count:
-					row += 1
-					col = 0
-
-			# Add the "Select none" box
-			none_canvas = tk.Canvas(root, width=uniform_width, height=uniform_height, bg="black")
-			none_canvas.create_text(
-				uniform_width // 2,
-				uniform_height // 2,
-				text="Select none",
-				fill="white",
-				font=("Arial", 14)
-			)
-			none_canvas.grid(row=row, column=col, padx=0, pady=0)
-			none_canvas.bind("<Button-1>", select_none)
-
-
-			# Bind Escape key
+			usable_screen_height = int(root.winfo_screenheight()*0.85)	# Leaving room for the title and buttons
+			thumbnail_layouts = {}		# choice index -> (thumbnail size, column count)
+			layouts_lock = threading.Lock()
+
+			# Title, progress and navigation
+			navigation_frame = tk.Frame(root, bg="black")
+			navigation_frame.pack(fill="x", padx=5, pady=5)
+			previous_button = tk.Button(navigation_frame, text="< Previous", command=lambda: move_to(state["cursor"] - 1))
+			previous_button.pack(side="left")
+			title_label = tk.Label(navigation_frame, bg="black", fg="white", font=("Arial", 14))
+			title_label.pack(side="left", padx=10)
+			next_button = tk.Button(navigation_frame, text="Next >", command=lambda: move_to(state["cursor"] + 1))
+			next_button.pack(side="right")
+			progress_bar = ttk.Progressbar(navigation_frame, maximum=len(pending_choices), length=200)
+			progress_bar.pack(side="right", padx=10)
+
+			grid_frame = tk.Frame(root, bg="black")
+			grid_frame.pack()
+			show_choice()
+
+			# Bind keys
 			root.bind("<Escape>", on_close_window)
+			root.bind("<Left>", lambda event: move_to(state["cursor"] - 1))
+			root.bind("<Right>", lambda event: move_to(state["cursor"] + 1))
 
 			# Center the window
 			root.after(10, lambda: center_dialog_box(root))
 
-			# Start main loop
-			root.mainloop()
+			# Load the thumbnails in the background
+			threading.Thread(target=load_thumbnails, daemon=True).start()
+			root.after(30, show_loaded_thumbnails)
 
-			return root.selected_image if hasattr(root, 'selected_image') else None
+			root.wait_window(root)
 
+			return {pending_choices[index][0]: image_path for index, image_path in chosen.items()}
 
-		def create_single_mouse_canvas():
-			cslo_count, oct_count = 0, 0
-			for image_modality in self.image_type_objects:
-				if image_modality.imager == "cslo":
-					cslo_count += 1
-				elif image_modality.imager == "oct":
-					oct_count += 1
-			
-			canvas_width = self.image_width * 2	# 2x because OD and OS
-			canvas_height = (self.cslo_height * cslo_count) + (self.oct_height * oct_count)
-			canvas = Image.new("RGB", (canvas_width, canvas_height), color="black")
 
-			return canvas
 
-		
+		self.selected_image_paths = {}
 
+		# Images are only chosen for the final document (and its render plan, which only replays the saved choices)
+		if self.mode not in ("full", "render_plan"):
+			return
 
-		# -- Main body of this function --
-		# Will take one mouse number (mouse_id) and loop through all images to generate a canvas with the chosen images compiled together
+		# Choices made in earlier runs are replayed (also in batch mode), unless the candidate images changed
+		manifest = self.load_selection_manifest()
+		manifest_changed = False
+
+		# Gathering every choice first, in the same order that the mice are placed in the document
+		pending_choices = []
+		for mouse_id in self.mice_in_layout_order():
+			for eye in self.mouse_image_list[mouse_id]:
+				for image_modality in self.image_type_objects:
+					if not image_modality.select_required or image_modality.multiple_index is not None:
+						continue
+
+					image_paths_with_same_modality = self.find_image_paths_with_modality(mouse_id, eye, image_modality)
+					if image_paths_with_same_modality:
+						dialog_title = (f"{mouse_id} {eye} - {image_modality.image_type_name}")
+						selection_key = (mouse_id, eye, image_modality.imager, image_modality.image_type_name)
+						manifest_entry = manifest.get("|".join(selection_key))
+						candidates = self.candidate_identities(image_paths_with_same_modality)
+						if manifest_entry is not None and manifest_entry["candidates"] == candidates:
+							self.selected_image_paths[selection_key] = manifest_entry["chosen"]
+						else:
+							pending_choices.append((selection_key, dialog_title, image_paths_with_same_modality))
+
+		# Never asking in batch mode or for a render plan, those images are left as placeholders
+		if pending_choices and not self.headless and self.mode == "full":
+			new_choices = choose_images_in_one_window(pending_choices)
+			self.selected_image_paths.update(new_choices)
+			for selection_key, _, image_paths_with_same_modality in pending_choices:
+				if selection_key in new_choices:
+					manifest["|".join(selection_key)] = {
+						"candidates": self.candidate_identities(image_paths_with_same_modality),
+						"chosen": new_choices[selection_key]
+					}
+					manifest_changed = True
+			ThumbnailCache.shared().evict()
+
+		if manifest_changed:
+			self.save_selection_manifest(manifest)
+
+	def selection_manifest_file_path(self):
+		"""<name>.selections.json next to the compilation document."""
+		return os.path.splitext(self.settings['final_product_file_path'])[0] + ".selections.json"
+
+	@staticmethod
+	def candidate_identities(image_paths):
+		"""The images that were offered for a choice, as [path, size, mtime] (a choice is asked again if any change)."""
+		candidates = []
+		for image_path in image_paths:
+			try:
+				image_stat = os.stat(image_path)
+				candidates.append([os.path.abspath(image_path), image_stat.st_size, image_stat.st_mtime_ns])
+			except OSError:
+				candidates.append([os.path.abspath(image_path), None, None])
+		return candidates
+
+	def load_selection_manifest(self):
+		"""Image choices from earlier runs: {"mouse|eye|imager|image type": {"candidates": [...], "chosen": path or None}}."""
+		try:
+			with open(self.selection_manifest_file_path(), "r", encoding="utf-8") as f:
+				manifest = json.load(f)
+		except (OSError, ValueError):
+			return {}
+		if manifest.get("version") != 1:
+			return {}
+		return manifest["selections"]
+
+	def save_selection_manifest(self, selections):
+		manifest_file_path = self.selection_manifest_file_path()
+		try:
+			write_file_atomically(manifest_file_path, json_writer({"version": 1, "selections": selections}, indent=4))
+		except OSError as error:
+			print(f"\nThe image choices could not be saved to {manifest_file_path}: {error}")
+
+
+	# ====================================================
+	# IMAGE LOADING
+	# ====================================================
+	def crop_cslo_image(self, image):
+		# Crops the text off of the bottom of the image
+		width, height = image.size
+		cropped_image = image.crop((0, 0, width, width))
+
+		return cropped_image
+	
+	def crop_oct_image(self, image, scale=1.0, retina_bounds=None):
+		# scale: decoded size / size on disk (the OCT height setting is in pixels of the image on disk)
+		# retina_bounds: (top, bottom) in pixels of the image on disk, if already known
+		desired_oct_height = round(int(self.settings['oct_height']) * scale)
+
+		# Case 1: Already correct height
+		if image.height == desired_oct_height:
+			return image
 		
-		# Early return
-		if mouse_id == "return_canvas_only":
-			blank_mouse_canvas_no_text = create_single_mouse_canvas()
-			return blank_mouse_canvas_no_text
+		# Determine where the center of the retina is
+		if retina_bounds is not None:
+			top_of_retina, bottom_of_retina = (round(bound * scale) for bound in retina_bounds)
+		else:
+			# Convert PIL → NumPy
+			img = np.array(image)
+			if img.ndim == 3:
+				# Normalize color channel order to BGR for OpenCV
+				if img.shape[2] == 4:
+					img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
+				else:
+					img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+			
+			top_of_retina, bottom_of_retina = find_oct_retina_bounds(img, int(self.settings.get('retina_column_step', 1)))
+		center_of_retina = (top_of_retina + bottom_of_retina) // 2
+
+		# Case 2: Crop if taller
+		if image.height > desired_oct_height:
+			top_crop, bottom_crop = self.oct_crop_rows(image.height, desired_oct_height, center_of_retina)
+			return image.crop((0, top_crop, image.width, bottom_crop))
 
-		# Initial canvas with only images (no headings)
-		individual_mouse_canvas_images_only = create_single_mouse_canvas()
+		# Case 3: Pad if shorter
+		new_img = Image.new("RGB", (image.width, desired_oct_height), color="black")
+		y_offset = (desired_oct_height - image.height) // 2
+		new_img.paste(image, (0, y_offset))
+		return new_img
+
+
+	@staticmethod
+	def oct_crop_rows(image_height, desired_oct_height, center_of_retina):
+		"""Top and bottom rows of the OCT crop window, centered on the retina where possible."""
+		half_height = desired_oct_height // 2
+		top_crop = max(center_of_retina - half_height, 0)
+		bottom_crop = top_crop + desired_oct_height
+
+		# Adjust if bottom exceeds bounds
+		if bottom_crop > image_height:
+			bottom_crop = image_height
+			top_crop = bottom_crop - desired_oct_height
+		return top_crop, bottom_crop
+
+	def crop_oct_pixels(self, image_path, pixels):
+		"""
+		crop_oct_image for a memory-mapped TIFF: only the rows inside the crop window are read and copied.
+		pixels is the view returned by memory_map_oct_tiff.
+		"""
+		desired_oct_height = int(self.settings['oct_height'])
+		image_height = pixels.shape[0]
+		if image_height < desired_oct_height:
+			return self.crop_oct_image(Image.fromarray(np.ascontiguousarray(pixels)))	# Padded, so the whole image is needed
+
+		if image_height > desired_oct_height:
+			retina_bounds = self.retina_bounds.get(image_path)
+			if retina_bounds is None:
+				retina_bounds = find_oct_retina_bounds(
+					pixels if pixels.ndim == 2 else cv2.cvtColor(pixels, cv2.COLOR_RGB2GRAY),
+					int(self.settings.get('retina_column_step', 1)))
+			center_of_retina = (retina_bounds[0] + retina_bounds[1]) // 2
+			top_crop, bottom_crop = self.oct_crop_rows(image_height, desired_oct_height, center_of_retina)
+			pixels = pixels[top_crop:bottom_crop]
+		return Image.fromarray(np.ascontiguousarray(pixels))
+
+	def request_reduced_decoding(self, img, source_size):
+		"""
+		Ask the decoder to skip resolution that would be thrown away when resizing to self.image_width.
+		source_size is the size of the tile before resizing, in pixels of the image on disk.
+		Only JPEG decoders support this (scaling by 1/2, 1/4 or 1/8), and only if the tile is at most half the source size.
+		"""
+		if not self.settings.get('reduced_decoding', True):
+			return
+		target_width = self.image_width
+		source_width, _ = source_size
+		if target_width * 2 > source_width:
+			return
+		requested_size = (target_width, math.ceil(img.height * target_width / source_width))
+		img.draft(img.mode, requested_size)
+
+	def plan_image_tile(self, image_modality, image_path):
+		"""
+		Work out the operations that turn an image into a tile ready to be pasted, and the size of that tile.
+		No image is opened (see image_header). The operations are plain dicts so they can be saved with the render plan.
+		"""
+		if image_path:
+			frame = self.oct_volume_frame(image_modality, image_path) if image_modality.imager == "oct" else 0
+			original_width, original_height, _ = self.image_header(image_path)	# The frames of a volume are all the same size
+			operations = [{"op": "open", "path": image_path, "size": [original_width, original_height]}]
+			if frame:
+				operations[0]["frame"] = frame
+
+			# Size of the tile before resizing, in pixels of the image on disk
+			if image_modality.imager == "cslo" and self.settings['crop_cslo_text_bool']:
+				operations.append({"op": "crop_cslo"})
+				source_size = (original_width, original_width)
+			elif image_modality.imager == "oct" and self.settings['oct_crop_bool']:
+				operations.append({"op": "crop_oct", "height": int(self.settings['oct_height'])})
+				source_size = (original_width, int(self.settings['oct_height']))
+			else:
+				source_size = (original_width, original_height)
+		else:
+			if image_modality.imager == "cslo":
+				source_size = (self.cslo_width, self.cslo_height)
+			elif image_modality.imager == "oct":
+				source_size = (self.oct_width, self.oct_height)
+			text = None
+			if self.mode == "preview_layout_and_images" and image_modality.select_required:
+				text = "No preview available"
+			operations = [{"op": "placeholder", "size": list(source_size), "text": text}]
+
+		# Resizing if needed
+		if source_size[0] != self.image_width:
+			new_width = self.image_width
+			w, h = source_size
+			aspect_ratio = h / w
+			new_height = int(new_width * aspect_ratio)
+			operations.append({"op": "resize", "size": [new_width, new_height]})
+			return operations, (new_width, new_height)
+
+		return operations, source_size
+
+	def oct_volume_frame(self, image_modality, image_path):
+		"""Frame to use from an OCT image (0 unless it's a volume), following settings['oct_volume_frames'] for its image type."""
+		if image_path not in self.oct_frames:
+			frame_rule = oct_volume_frame_rule(self.settings.get('oct_volume_frames'), image_modality.image_type_name)
+			self.oct_frames[image_path] = choose_oct_volume_frame(image_path, frame_rule, self.image_header(image_path)[2])
+		return self.oct_frames[image_path]
+
+	def find_oct_volume_frames(self, sections):
+		"""
+		Frames of the OCT volumes in sections whose image type uses the "max_signal" rule, all found at once
+		(see find_max_signal_frames) rather than one volume at a time while the mice are laid out.
+		"""
+		if self.mode == "preview_layout":	# No images are laid out
+			return
+		image_paths = []
+		for _, group_mice_list in sections:
+			for mouse_id in group_mice_list:
+				for eye in self.mouse_image_list[mouse_id]:
+					for image_modality in self.image_type_objects:
+						if image_modality.imager != "oct":
+							continue
+						if oct_volume_frame_rule(self.settings.get('oct_volume_frames'), image_modality.image_type_name) != "max_signal":
+							continue
+						image_path = self.choose_image_path(mouse_id, eye, image_modality)
+						if image_path and image_path not in self.oct_frames:
+							image_paths.append(image_path)
+		if image_paths:
+			find_max_signal_frames(image_paths, {image_path: self.image_header(image_path)[2] for image_path in image_paths})
+
+	def image_header(self, image_path):
+		"""[width, height, number of frames] of an image, from the catalog of its directory (see ImageCatalog.image_header)."""
+		image_path = os.path.normpath(os.path.abspath(image_path))
+		for catalog in self.image_catalogs:
+			if image_path.startswith(catalog.root_directory + os.sep):
+				return catalog.image_header(image_path)
+		return ImageCatalog.read_image_header(image_path)
+
+	def tile_parameters(self):
+		"""Besides the operations of a tile, these are the only settings that change its pixels."""
+		return {
+			"resample": "LANCZOS",
+			"retina_column_step": int(self.settings.get('retina_column_step', 1)),
+			"reduced_decoding": bool(self.settings.get('reduced_decoding', True)),	# See request_reduced_decoding
+			"image_width": self.image_width
+		}
+
+	def load_image_tile(self, element):
+		"""Return the tile of a tile element, from the tile cache if it was made before."""
+		if self.tile_cache is None or element.operations[0]["op"] != "open":	# Placeholders are quicker to draw again
+			return self.process_image_tile(element)
+
+		key = self.tile_cache.key(element.operations, self.tile_parameters())
+		if key is None:
+			return self.process_image_tile(element)
+		img = self.tile_cache.get(key)
+		if img is None:
+			img = self.process_image_tile(element)
+			self.tile_cache.set(key, img)
+		return img
+
+	def process_image_tile(self, element):
+		"""Carry out the operations of a tile element (open, crop, resize...) and return the tile."""
+		img = None
+		decode_scale = 1.0
+		image_path = None
+		pixels = None		# Memory-mapped TIFF, for OCT images that are cropped straight after opening
+		for operation in element.operations:
+			if operation["op"] == "open":
+				image_path = operation["path"]
+				if len(element.operations) > 1 and element.operations[1]["op"] == "crop_oct":
+					pixels = memory_map_oct_tiff(image_path, operation.get("frame", 0))
+					if pixels is not None:
+						continue
+				img = open_oct_frame(image_path, operation.get("frame", 0))
+				original_width, _ = operation["size"]
+				tile_source_size = self.tile_source_size(element.operations)
+				self.request_reduced_decoding(img, tile_source_size)
+				img.load()	# Decode now, so this is done on the prefetch thread rather than when pasting
+				decode_scale = img.width / original_width
+
+			elif operation["op"] == "placeholder":
+				w, h = operation["size"]
+				img = Image.new("RGB", (w, h), color="black")
+				if operation["text"]:
+					draw = ImageDraw.Draw(img)
+					text = operation["text"]
+					with self.font_lock:
+						font = ImageFont.load_default(size=60)
+						text_w, text_h, baseline_offset = self.measure_text(font, text)
+						x = (w - text_w) / 2
+						y = (h - text_h) / 2
+						draw.text((x, y+baseline_offset), text, font=font, fill="white")
+
+			elif operation["op"] == "crop_cslo":
+				img = self.crop_cslo_image(img)
+
+			elif operation["op"] == "crop_oct":
+				if pixels is not None:
+					img = self.crop_oct_pixels(image_path, pixels)
+					pixels = None
+				else:
+					img = self.crop_oct_image(img, decode_scale, self.retina_bounds.get(image_path))
+
+			# The size comes from the image on disk, so reduced decoding doesn't change the layout
+			elif operation["op"] == "resize":
+				if img.size != tuple(operation["size"]):
+					img = img.resize(tuple(operation["size"]), Image.LANCZOS)
+
+			elif operation["op"] == "crop":
+				img = img.crop(tuple(operation["box"]))
+
+		return img
+
+	@staticmethod
+	def tile_source_size(operations):
+		"""Size of a tile before resizing, in pixels of the image on disk."""
+		size = None
+		for operation in operations:
+			if operation["op"] in ("open", "placeholder"):
+				size = tuple(operation["size"])
+			elif operation["op"] == "crop_cslo":
+				size = (size[0], size[0])
+			elif operation["op"] == "crop_oct":
+				size = (size[0], operation["height"])
+		return size
+
+	def prefetch(self, function, items):
+		"""
+		Yield function(item) for every item, in order, while the next items are already being worked on by the
+		prefetch threads. No more than prefetch_depth results are waiting in memory at a time.
+		"""
+		if self.prefetch_executor is None:
+			for item in items:
+				yield function(item)
+			return
+
+		prefetch_depth = max(int(self.settings.get('prefetch_depth', 2)), 1)
+		items = iter(items)
+		pending = collections.deque(
+			self.prefetch_executor.submit(function, item) for item in itertools.islice(items, prefetch_depth)
+		)
+		while pending:
+			result = pending.popleft().result()
+			for item in itertools.islice(items, 1):		# Keep the queue topped up before handing the result over
+				pending.append(self.prefetch_executor.submit(function, item))
+			yield result
+
+
+	# ====================================================
+	# IMAGE ASSEMBLY
+	# ====================================================
+	def layout_mouse(self, mouse_id, origin=(0, 0)):
+		"""
+		Layout elements (headings, the black image area and the image tiles) of one mouse whose top left corner is at origin.
+		Also defines self.total_heading_height. Only image headers are read, nothing is rendered.
+		"""
+		LayoutElement = self.LayoutElement
+		origin_x, origin_y = origin
+		mouse_width = self.image_width * 2	# 2x because OD and OS
+		text_color = self.settings['text_color']
 
 
 		# -- Creating the text heading area --
@@ -2015,7 +4314,7 @@ class ImageCompilation:
 		gap_after_od_os = 25
 
 
-		# Create mouse number text (but not draw yet)
+		# Create mouse number text
 		use_cslo_number_heading = self.settings['cslo_number_bool']
 		use_labID_heading = self.settings['labID_bool']
 		if use_cslo_number_heading:							# If user selected to use the cSLO number
@@ -2026,140 +4325,65 @@ class ImageCompilation:
 		else:												# If user selected to not use either number (will still put a blank space)
 			ID_heading_text = ""
 		ID_heading_w, ID_heading_h, baseline_offset = self.measure_text(heading_font, ID_heading_text)
-		ID_heading_x = (individual_mouse_canvas_images_only.width - ID_heading_w) // 2
-		ID_heading_y = gap_before_ID_heading + baseline_offset
+		ID_heading_x = (mouse_width - ID_heading_w) // 2
+		ID_heading_y = gap_before_ID_heading
 		ID_heading_bottom = gap_before_ID_heading + heading_h
+		heading_elements = [
+			LayoutElement.from_text(ID_heading_text, heading_font, (origin_x + ID_heading_x, origin_y + ID_heading_y),
+						   'heading_font', text_color)
+		]
 
-		additional_heading_text = None
 		if use_cslo_number_heading and use_labID_heading:	# If both cSLO number and lab ID are to be used
 			labID = self.mouse_info_dic[mouse_id][0]
 			additional_heading_text = f"({labID})"
 			additional_ID_heading_w, _, additional_baseline_offset = self.measure_text(subheading_font, additional_heading_text)
 			_, additional_ID_heading_h, _ = self.measure_text(heading_font, "Hpqy")
-			additional_ID_heading_x = (individual_mouse_canvas_images_only.width - additional_ID_heading_w) // 2
-			additional_ID_heading_y = ID_heading_bottom + gap_after_ID_heading + additional_baseline_offset
-			ID_heading_bottom = additional_ID_heading_y + additional_ID_heading_h
+			additional_ID_heading_x = (mouse_width - additional_ID_heading_w) // 2
+			additional_ID_heading_y = ID_heading_bottom + gap_after_ID_heading
+			ID_heading_bottom = additional_ID_heading_y + additional_baseline_offset + additional_ID_heading_h
+			heading_elements.append(LayoutElement.from_text(
+				additional_heading_text, subheading_font,
+				(origin_x + additional_ID_heading_x, origin_y + additional_ID_heading_y),
+				'subheading_font', text_color
+			))
 
 
-		# Create OD and OS text (but not draw yet)
+		# Create OD and OS text
 		od_w, od_h, od_offset = self.measure_text(subheading_font, "OD")
 		od_x = (self.image_width - od_w) // 2
 		os_x = od_x + self.image_width
 		od_y = ID_heading_bottom + gap_after_ID_heading
 		os_y = od_y
+		heading_elements.append(LayoutElement.from_text("OD", subheading_font, (origin_x + od_x, origin_y + od_y), 'subheading_font', text_color))
+		heading_elements.append(LayoutElement.from_text("OS", subheading_font, (origin_x + os_x, origin_y + os_y), 'subheading_font', text_color))
 		
-		# Create new canvas with heading area
 		self.total_heading_height = od_y + od_h + gap_after_od_os
-		new_height = individual_mouse_canvas_images_only.height + self.total_heading_height
-		new_width = individual_mouse_canvas_images_only.width
-		new_canvas = Image.new("RGB", (new_width, new_height), color=self.settings['background_color'])
-		new_canvas.paste(individual_mouse_canvas_images_only, (0, self.total_heading_height))
-		individual_mouse_canvas = new_canvas
-
-
-		# Draw heading texts
-		draw = ImageDraw.Draw(individual_mouse_canvas)
-		draw.text((ID_heading_x, ID_heading_y), 
-			ID_heading_text, font=heading_font, fill=self.settings['text_color'])
-		if additional_heading_text:
-			draw.text((additional_ID_heading_x, additional_ID_heading_y), 
-			additional_heading_text, font=subheading_font, fill=self.settings['text_color'])
-		draw.text((od_x, od_y + od_offset), 
-			"OD", font=subheading_font, fill=self.settings['text_color'])
-		draw.text((os_x, os_y + od_offset), 
-			"OS", font=subheading_font, fill=self.settings['text_color'])
-
 
-		x_offset_od = 0
-		x_offset_os = self.image_width
-		y_offset_od = self.total_heading_height
-		y_offset_os = self.total_heading_height
 
+		# Black background behind the images
+		_, mouse_height = self.mouse_canvas_size()
+		image_area = LayoutElement.from_fill(
+			(origin_x, origin_y + self.total_heading_height),
+			(mouse_width, mouse_height - self.total_heading_height),
+			(0, 0, 0)
+		)
+		elements = [image_area] + heading_elements
 
-		# Ending this part if all that was needed was defining self.total_heading_height
-		if mouse_grid_mode == "initiate heading":
-			return ""
-
+		# The layout preview doesn't show any images
 		if self.mode == "preview_layout":
-			return individual_mouse_canvas
+			return elements
 
 
-		# Add the images to the mouse canvas
-		for eye, cslo_and_oct_image_list in self.mouse_image_list[mouse_id].items():
+		# Images of the mouse, in the order they are pasted
+		x_offset_od = image_area.left
+		x_offset_os = image_area.left + self.image_width
+		y_offset_od = image_area.top
+		y_offset_os = image_area.top
+		for eye in self.mouse_image_list[mouse_id]:
 			for image_modality in self.image_type_objects:	# Loops through the images the user selected they wanted (i.e. BAF, IRAF, horizontal, etc.)
-				image_path_to_use = None
-				
-				available_image_paths = cslo_and_oct_image_list[image_modality.imager]	# All paths for that imager and eye
-				
-
-				# -- Defining the image path --
-				only_one_image_exists = not image_modality.select_required and image_modality.multiple_index is None
-				# If there aren't any images from that imager (cslo/oct)
-				if not available_image_paths:
-					image_path_to_use = None
-
-				# If the modality shouldn't have multiple images and thus just needs to grab the image that has the correct modality
-				elif only_one_image_exists:
-					for image_path in available_image_paths:
-						_, _, _, _, modality = self.convert_path_to_base_name_and_parts(image_path, image_modality.imager)
-						if modality == image_modality.image_type_name:
-							image_path_to_use = image_path
-							break
+				image_path_to_use = self.choose_image_path(mouse_id, eye, image_modality)
+				operations, (tile_w, tile_h) = self.plan_image_tile(image_modality, image_path_to_use)
 
-				else:
-					# Create a list of all paths with the modality of interest
-					image_paths_with_same_modality = []
-					for image_path in available_image_paths:
-						_, image_number, _, _, modality = self.convert_path_to_base_name_and_parts(image_path, image_modality.imager)
-						if modality == image_modality.image_type_name:
-							image_paths_with_same_modality.append((int(image_number), image_path))
-					image_paths_with_same_modality.sort(key=lambda x: x[0])	# Sorting the list by image_number
-					image_paths_with_same_modality = [x[1] for x in image_paths_with_same_modality]	# Making the list just image_path
-
-
-					# If we just need to grab the nth image with that modality
-					if image_modality.multiple_index is not None:
-						index_to_use = image_modality.multiple_index
-					
-						# Grab the image with the correct index, unless it can't, then don't use any image
-						try:
-							image_path_to_use = image_paths_with_same_modality[index_to_use]
-						except IndexError:
-							image_path_to_use = None
-
-					# If the user needs to select the image
-					elif image_modality.select_required:
-						if image_paths_with_same_modality and self.mode == "full":
-							dialog_title = (f"{mouse_id} {eye} - {image_modality.image_type_name}")
-							image_path_to_use = user_choose_which_images_to_use(image_paths_with_same_modality, dialog_title)
-						else:
-							image_path_to_use = None
-				
-
-				# -- Putting the image into the individual mouse canvas --
-				if image_path_to_use:
-					img = Image.open(image_path_to_use)
-					if image_modality.imager == "cslo" and self.settings['crop_cslo_text_bool']:
-						img = crop_cslo_image(img)
-					elif image_modality.imager == "oct" and self.settings['oct_crop_bool']:
-						img = crop_oct_image(img)
-				else:
-					if image_modality.imager == "cslo":
-						w, h = self.cslo_width, self.cslo_height
-					elif image_modality.imager == "oct":
-						w, h = self.oct_width, self.oct_height
-					img = Image.new("RGB", (w, h), color="black")
-
-					if self.mode == "preview_layout_and_images" and image_modality.select_required:
-						draw = ImageDraw.Draw(img)
-						text = "No preview available"
-						font = ImageFont.load_default(size=60)
-						text_w, text_h, baseline_offset = self.measure_text(font, text)
-						x = (w - text_w) / 2
-						y = (h - text_h) / 2
-						draw.text((x, y+baseline_offset), text, font=font, fill="white")
-
-					
 				# Setting x, y offsets
 				if eye == "OD":
 					x_offset = x_offset_od
@@ -2168,126 +4392,246 @@ class ImageCompilation:
 					x_offset = x_offset_os
 					y_offset = y_offset_os
 
-				# Resizing if needed
-				if img.width != self.image_width:
-					new_width = self.image_width
-					w, h = img.size
-					aspect_ratio = h / w
-					new_height = int(new_width * aspect_ratio)
-					img = img.resize((new_width, new_height), Image.LANCZOS)
-
-				# Pasting img into canvas
-				individual_mouse_canvas.paste(img, (x_offset, y_offset))
+				# Images can't spill out of this mouse's area (it could be next to another mouse on the master canvas)
+				visible_height = min(tile_h, image_area.bottom - y_offset)
+				if visible_height > 0:
+					if visible_height < tile_h:
+						operations.append({"op": "crop", "box": [0, 0, tile_w, visible_height]})
+					elements.append(LayoutElement.from_tile(
+						mouse_id, image_path_to_use, operations, (x_offset, y_offset), (tile_w, visible_height)
+					))
 				
 				# Adjusting offsets
 				if eye == "OD":
-					y_offset_od += img.height
+					y_offset_od += tile_h
 				elif eye == "OS":
-					y_offset_os += img.height
+					y_offset_os += tile_h
+
+		return elements
+
+	def assemble_mouse_image_grid(self, mouse_id, mouse_grid_mode="Normal"):
+		"""Creates image compilation for one mouse"""
+		def create_single_mouse_canvas():
+			cslo_count, oct_count = 0, 0
+			for image_modality in self.image_type_objects:
+				if image_modality.imager == "cslo":
+					cslo_count += 1
+				elif image_modality.imager == "oct":
+					oct_count += 1
+			
+			canvas_width = self.image_width * 2	# 2x because OD and OS
+			canvas_height = (self.cslo_height * cslo_count) + (self.oct_height * oct_count)
+			canvas = Image.new("RGB", (canvas_width, canvas_height), color="black")
 
+			return canvas
 
 
+		# Early return
+		if mouse_id == "return_canvas_only":
+			blank_mouse_canvas_no_text = create_single_mouse_canvas()
+			return blank_mouse_canvas_no_text
+
+		elements = self.layout_mouse(mouse_id)
+
+		# Ending this part if all that was needed was defining self.total_heading_height
+		if mouse_grid_mode == "initiate heading":
+			return ""
+
+		individual_mouse_canvas = Image.new("RGB", self.mouse_canvas_size(), color=self.settings['background_color'])
+		self.draw_layout_elements(individual_mouse_canvas, elements)
 		return individual_mouse_canvas
 
 	# ====================================================
 	# CANVAS AND LAYOUT
 	# ====================================================
-	def create_master_canvas(self):
-		"""Create the master canvas based on one example mouse."""
-
-		# Unpacking self.settings to make easier to read
-		
-		column_margin_size = int(self.settings['column_margin_size'])	# int
-		row_margin_size = int(self.settings['row_margin_size'])			# int
-		outer_margin_size = int(self.settings['outer_margin_size'])		# int
-		number_of_rows = int(self.settings['number_of_rows'])			# int
-		number_of_columns = int(self.settings['number_of_columns'])		# int
-		
-		# Unpacking some self.settings to make easier to read
-		outer_margin_size = int(self.settings['outer_margin_size'])
-		background_color = self.settings['background_color'] 			# (x, x, x)
-		text_color = self.settings['text_color']						# (x, x, x)
+	@dataclass
+	class LayoutElement:
+		kind: Literal["text", "fill", "tile"]
+		position: Tuple[int, int]
+		width: int
+		height: int
+		text: Optional[str] = None
+		font: Optional[ImageFont.FreeTypeFont] = None
+		font_key: Optional[str] = None			# Which font in the settings (e.g. 'heading_font')
+		color: Optional[Tuple[int, int, int]] = None
+		mouse_id: Optional[str] = None
+		source_path: Optional[str] = None
+		operations: list = field(default_factory=list)	# How a tile is made from its source image (see plan_image_tile)
+		image: Optional[Image.Image] = None		# Only set while a tile is being pasted
+
+		@property
+		def right(self): return self.position[0] + self.width
+		@property
+		def bottom(self): return self.position[1] + self.height
+		@property
+		def left(self): return self.position[0]
+		@property
+		def top(self): return self.position[1]
+		@property
+		def center_x(self): return self.left + self.width // 2
+		@property
+		def center_y(self): return self.top + self.height // 2
 
+		@classmethod
+		def from_text(cls, text: str, font: ImageFont.FreeTypeFont, position: Tuple[int, int], font_key=None, color=None):
+			draw = ImageDraw.Draw(Image.new("RGB", (10, 10)))
+			bbox = draw.textbbox((0, 0), text, font=font)
+			width = bbox[2] - bbox[0]
+			height = bbox[3] - bbox[1]
+			
+			return cls(
+				kind="text",
+				text=text,
+				font=font,
+				font_key=font_key,
+				color=color,
+				position=position,
+				width=width,
+				height=height
+			)
 
+		@classmethod
+		def from_fill(cls, position: Tuple[int, int], size: Tuple[int, int], color):
+			return cls(
+				kind="fill",
+				color=color,
+				position=position,
+				width=size[0],
+				height=size[1]
+			)
 
-		
-		@dataclass
-		class LayoutElement:
-			kind: Literal["text", "image"]
-			position: Tuple[int, int]
-			width: int
-			height: int
-			text: Optional[str] = None
-			font: Optional[ImageFont.FreeTypeFont] = None
-			image: Optional[Image.Image] = None
-
-			@property
-			def right(self): return self.position[0] + self.width
-			@property
-			def bottom(self): return self.position[1] + self.height
-			@property
-			def left(self): return self.position[0]
-			@property
-			def top(self): return self.position[1]
-			@property
-			def center_x(self): return self.left + self.width // 2
-			@property
-			def center_y(self): return self.top + self.height // 2
-
-			@classmethod
-			def from_text(cls, text: str, font: ImageFont.FreeTypeFont, position: Tuple[int, int]):
-				draw = ImageDraw.Draw(Image.new("RGB", (10, 10)))
-				bbox = draw.textbbox((0, 0), text, font=font)
-				width = bbox[2] - bbox[0]
-				height = bbox[3] - bbox[1]
-				y_offset = -bbox[1]
-				
-				return cls(
-					kind="text",
-					text=text,
-					font=font,
-					position=position,
-					width=width,
-					height=height
-				)
+		@classmethod
+		def from_tile(cls, mouse_id: str, source_path: Optional[str], operations: list, position: Tuple[int, int], size: Tuple[int, int]):
+			return cls(
+				kind="tile",
+				mouse_id=mouse_id,
+				source_path=source_path,
+				operations=operations,
+				position=position,
+				width=size[0],
+				height=size[1]
+			)
 
-			@classmethod
-			def from_image(cls, image: Image.Image, position: Tuple[int, int]):
-				return cls(
-					kind="image",
-			   		image=image,
-					position=position,
-					width=image.width,
-					height=image.height
+		# Draw itself on a canvas (origin: where the canvas' top left corner is in the document)
+		def draw_on_canvas(self, canvas: Image.Image, origin: Tuple[int, int] = (0, 0)):
+			x = self.position[0] - origin[0]
+			y = self.position[1] - origin[1]
+			if self.kind == "text":
+				draw_obj = ImageDraw.Draw(canvas)
+				bbox = self.font.getbbox(self.text) 
+				draw_obj.text(
+					(x, y - bbox[1]),
+					self.text,
+					font=self.font,
+					fill=self.color
 				)
 
-			# Draw itself on a canvas
-			def draw_on_canvas(self, canvas: Image.Image):
-				draw_obj = ImageDraw.Draw(canvas)
-				if self.kind == "text":
-					bbox = self.font.getbbox(self.text) 
-					draw_obj.text(
-						(self.position[0], self.position[1] - bbox[1]),
-						self.text,
-						font=self.font,
-						fill=text_color
-					)
+			elif self.kind == "fill":
+				canvas.paste(self.color, (x, y, x + self.width, y + self.height))
+
+			elif self.kind == "tile":
+				canvas.paste(self.image, (x, y))
+
+		def to_dict(self):
+			"""The element as plain data for the JSON render plan (fonts by settings key, no pixels)."""
+			element_dict = {"kind": self.kind, "rect": [self.left, self.top, self.width, self.height]}
+			if self.kind == "text":
+				element_dict.update(text=self.text, font=self.font_key, color=list(self.color))
+			elif self.kind == "fill":
+				element_dict.update(color=list(self.color))
+			elif self.kind == "tile":
+				element_dict.update(mouse=self.mouse_id, source_path=self.source_path, operations=self.operations)
+			return element_dict
+
+
+	def mouse_canvas_size(self):
+		"""Width and height of one mouse canvas (headings and images), known without rendering it."""
+		cslo_count, oct_count = 0, 0
+		for image_modality in self.image_type_objects:
+			if image_modality.imager == "cslo":
+				cslo_count += 1
+			elif image_modality.imager == "oct":
+				oct_count += 1
+
+		width = self.image_width * 2	# 2x because OD and OS
+		height = self.total_heading_height + (self.cslo_height * cslo_count) + (self.oct_height * oct_count)
+		return width, height
+
+
+	@contextlib.contextmanager
+	def rendering_threads(self):
+		"""Start (and afterwards stop) the thread pools used for rendering mouse canvases and prefetching images."""
+		# Optionally rendering the mouse canvases on several threads (PIL releases the GIL while decoding and resizing)
+		parallel_workers = int(self.settings.get('parallel_workers', 0) or 0)
+		if parallel_workers > 1:
+			self.mouse_executor = ThreadPoolExecutor(max_workers=parallel_workers)
+
+		# Prefetching the images of each mouse (prefetch_depth images ahead per mouse being rendered, 0 turns it off)
+		prefetch_depth = int(self.settings.get('prefetch_depth', 2) or 0)
+		if prefetch_depth > 0:
+			self.prefetch_executor = ThreadPoolExecutor(max_workers=prefetch_depth * max(parallel_workers, 1))
 
-				elif self.kind == "image":
-					canvas.paste(self.image, self.position)
+		try:
+			yield
+		finally:
+			for executor in (self.mouse_executor, self.prefetch_executor):
+				if executor is not None:
+					executor.shutdown()
+			self.mouse_executor = None
+			self.prefetch_executor = None
+			if self.tile_cache is not None:
+				self.tile_cache.evict()
+
+
+	def layout_sections(self):
+		"""The mice of the document in layout order, as (group, mouse_list) pairs (group is None if there are no groups)."""
+		group_order = self.settings['group_order']
+		if group_order:
+			sections = []
+			for group in group_order:
+				group_mice_list = []
+				for mouse, mouse_info in self.settings['mouse_info_dic'].items():
+					if mouse_info[1] == group:
+						group_mice_list.append(mouse)
+				sections.append((group, group_mice_list))
+			return sections
+		return [(None, list(self.settings['mouse_info_dic'].keys()))]
+
+	def layout_master_canvas(self, sections=None, subtitle=None):
+		"""
+		Work out where everything goes on the master canvas (the render plan), without rendering anything.
+		Only the mice in sections are laid out (all of them by default, see layout_sections).
+		Fills self.master_canvas_elements and self.master_canvas_size, and returns both.
+		"""
+		if sections is None:
+			sections = self.layout_sections()
+		if subtitle is None:
+			subtitle = self.settings['subtitle']
 
+		# Unpacking self.settings to make easier to read
+		
+		column_margin_size = int(self.settings['column_margin_size'])	# int
+		row_margin_size = int(self.settings['row_margin_size'])			# int
+		outer_margin_size = int(self.settings['outer_margin_size'])		# int
+		number_of_rows = int(self.settings['number_of_rows'])			# int
+		number_of_columns = int(self.settings['number_of_columns'])		# int
 		
+		LayoutElement = self.LayoutElement
+		mouse_width, mouse_height = self.mouse_canvas_size()
+		text_color = self.settings['text_color']
 
 		# Creating text elements
 		title_element = LayoutElement.from_text(
 			self.settings['document_title'], 
 			self.settings['title_font'], 
-			(outer_margin_size, outer_margin_size)
+			(outer_margin_size, outer_margin_size),
+			'title_font', text_color
 			)
 		subtitle_element = LayoutElement.from_text(
-			self.settings['subtitle'],
+			subtitle,
 			self.settings['subtitle_font'],
-			(outer_margin_size, title_element.bottom + (title_element.height//5))
+			(outer_margin_size, title_element.bottom + (title_element.height//5)),
+			'subtitle_font', text_color
 		)
 		
 		self.master_canvas_elements = [
@@ -2338,7 +4682,7 @@ class ImageCompilation:
 				font = self.settings['heading_font']
 				text_x = x_offset
 				text_y = top_of_image + position_halfway_vertically(text, font, modality.imager)
-				modality_text_element = LayoutElement.from_text(text, font, (text_x, text_y))
+				modality_text_element = LayoutElement.from_text(text, font, (text_x, text_y), 'heading_font', text_color)
 				self.master_canvas_elements.append(modality_text_element)
 
 				if modality_text_element.width > modality_text_max_width:
@@ -2352,7 +4696,6 @@ class ImageCompilation:
 
 
 		def assemble_mouse_canvases_into_layout(mouse_list, y_offset):
-			nonlocal i
 			column_count = 0
 			column_one_x_offset = determine_size_of_column_one_x_offset()
 			x_offset = column_one_x_offset
@@ -2362,60 +4705,43 @@ class ImageCompilation:
 				if column_count == 0:
 					insert_image_modality_text(y_offset)
 				
-				# Creating individual mouse compilation
-				mouse_canvas = self.assemble_mouse_image_grid(mouse)
-				mouse_element = LayoutElement.from_image(
-					mouse_canvas,
-					(x_offset, y_offset)
-				)
-				self.master_canvas_elements.append(mouse_element)
+				# Placing the individual mouse compilation
+				self.master_canvas_elements.extend(self.layout_mouse(mouse, (x_offset, y_offset)))
+				mouse_bottom = y_offset + mouse_height
 				
 				# Determining the next column/row to use
 				column_count += 1
 				if column_count == number_of_columns:
 					x_offset = column_one_x_offset
-					y_offset = mouse_element.bottom + row_margin_size
+					y_offset = mouse_bottom + row_margin_size
 					column_count = 0
 				else:
-					x_offset = mouse_element.right + column_margin_size
-
-				status(f"Processing mouse canvases: {i}/{number_of_mice}")
+					x_offset = x_offset + mouse_width + column_margin_size
 			
-			bottom_pixel = mouse_element.bottom
+			bottom_pixel = mouse_bottom
 			return(bottom_pixel)
 
-		# Determining location and pasting mouse images onto master canvas
-		group_order = self.settings['group_order']
+		# Determining location of mouse canvases on master canvas
 		y_offset = subtitle_element.bottom + row_margin_size
 
-		number_of_mice = len(self.settings['mouse_info_dic'])
-		i = 1
-
-		if group_order:		# Only doing the group loop if there are actually groups defined
-			for group in group_order:
-				# Create group name element
+		for group, group_mice_list in sections:
+			# Create group name element (only if there are actually groups defined)
+			if group is not None:
 				group_element = LayoutElement.from_text(
 					group,
 					self.settings['group_font'],
-					(outer_margin_size, y_offset)
+					(outer_margin_size, y_offset),
+					'group_font', text_color
 				)
 				self.master_canvas_elements.append(group_element)
 				_, group_text_h, _ = self.measure_text(self.settings['group_font'], group)
 				y_offset += group_text_h + int(row_margin_size / 2)
 
-				# Assembling the mouse canvases into the layout for the group
-				group_mice_list = []
-				for mouse, mouse_info in self.settings['mouse_info_dic'].items():
-					if mouse_info[1] == group:
-						group_mice_list.append(mouse)
-				bottom_pixel = assemble_mouse_canvases_into_layout(group_mice_list, y_offset)
-				
-				# Adjusting the y_offset
-				y_offset  = bottom_pixel + (row_margin_size * 2)
-				
-		else:
-			mouse_list = list(self.settings['mouse_info_dic'].keys())
-			_ = assemble_mouse_canvases_into_layout(mouse_list, y_offset)
+			# Assembling the mouse canvases into the layout for the group
+			bottom_pixel = assemble_mouse_canvases_into_layout(group_mice_list, y_offset)
+			
+			# Adjusting the y_offset
+			y_offset  = bottom_pixel + (row_margin_size * 2)
 
 
 
@@ -2430,23 +4756,294 @@ class ImageCompilation:
 				bottom_most_pixel = element.bottom
 			
 
-		# Creating the master canvas
+		# Size of the master canvas
 		master_width = right_most_pixel + outer_margin_size
 		master_height = bottom_most_pixel + outer_margin_size
-		self.master_canvas = Image.new('RGB', (master_width, master_height), background_color)
-		
+		self.master_canvas_size = (master_width, master_height)
+
+		# Image headers read for the first time are kept for the next layout
+		for catalog in self.image_catalogs:
+			catalog.save()
+		return self.master_canvas_elements, self.master_canvas_size
+
+
+	def document_size(self):
+		"""
+		Size of the compilation document (its largest page, if it is split into pages) and its number of pages,
+		from the layout alone, e.g. for the size readout in the settings dialog box. Nothing is rendered.
+		"""
+		self.add_non_user_defined_settings()
+		self.build_mouse_image_list()
+		example_mouse_number = list(self.mouse_image_list.keys())[0]
+		self.layout_mouse(example_mouse_number)		# Defines self.total_heading_height
+		page_sizes = [size for _, size in self.paginate_layout()]
+		return (max(width for width, _ in page_sizes), max(height for _, height in page_sizes)), len(page_sizes)
+
+	def render_plan(self, page_layout=None):
+		"""
+		The render plan of a page (the whole master canvas by default) as plain data
+		(sizes, rectangles, source paths and tile operations), e.g. for JSON.
+		"""
+		elements, size = page_layout or (self.master_canvas_elements, self.master_canvas_size)
+		return {
+			"size": list(size),
+			"background_color": list(self.settings['background_color']),
+			"elements": [element.to_dict() for element in elements]
+		}
+
+	def export_render_plan(self, file_path, page_layout=None):
+		with open(file_path, "w") as file:
+			json.dump(self.render_plan(page_layout), file, indent=1)
+
+	def export_page_render_plans(self, page_layouts):
+		"""Save the render plan of each page, named like the pages (file_name.plan.json or file_name_page01.plan.json)"""
+		base_path = os.path.splitext(self.settings['final_product_file_path'])[0]
+		if len(page_layouts) == 1:
+			plan_file_paths = [base_path + ".plan.json"]
+		else:
+			plan_file_paths = [f"{base_path}_page{page_number:02d}.plan.json" for page_number in range(1, len(page_layouts) + 1)]
+		for page_layout, plan_file_path in zip(page_layouts, plan_file_paths):
+			self.export_render_plan(plan_file_path, page_layout)
+		return plan_file_paths
+
+
+	def draw_layout_elements(self, canvas, elements, origin=(0, 0)):
+		"""
+		Rasterizer for the render plan: draw elements onto a canvas whose top left corner is at origin in the document.
+		Text and fills are drawn first, then the image tiles of each mouse (concurrently if parallel_workers is set).
+		"""
+		tiles_of_each_mouse = {}
+		for element in elements:
+			if element.kind == "tile":
+				tiles_of_each_mouse.setdefault(element.mouse_id, []).append(element)
+			elif element.kind == "text":
+				with self.font_lock:
+					element.draw_on_canvas(canvas, origin)
+			else:
+				element.draw_on_canvas(canvas, origin)
+
+		self.find_retina_bounds_of_tiles(tiles_of_each_mouse)
+
+		# Grids of mice already rendered this session (e.g. by a preview) are reused (mouse_grid_cache_mb, 0 turns it off)
+		mouse_grid_cache_bytes = int(self.settings.get('mouse_grid_cache_mb', 512) or 0) * 1024 * 1024
+		mouse_grid_cache = None
+		if self.reuse_mouse_grids and mouse_grid_cache_bytes > 0:
+			mouse_grid_cache = MouseGridCache.shared()
+
+		# Decoding, cropping and resizing of the next tiles happens while the current one is pasted
+		def draw_tiles(tile_elements):
+			if mouse_grid_cache is None:
+				tile_keys = [None] * len(tile_elements)
+				tiles = [None] * len(tile_elements)
+			else:
+				tile_keys = [TileCache.key(element.operations, self.tile_parameters()) for element in tile_elements]
+				tiles = mouse_grid_cache.get(tile_elements[0].mouse_id, tile_keys)
+
+			missing_tile_elements = [element for element, img in zip(tile_elements, tiles) if img is None]
+			loaded_tiles = self.prefetch(self.load_image_tile, missing_tile_elements)
+			grid = {}
+			for element, tile_key, img in zip(tile_elements, tile_keys, tiles):
+				if img is None:
+					img = next(loaded_tiles)
+				element.image = img
+				element.draw_on_canvas(canvas, origin)
+				element.image = None
+				if tile_key is not None:
+					grid[tile_key] = img
+
+			if mouse_grid_cache is not None:
+				mouse_grid_cache.set(tile_elements[0].mouse_id, grid, mouse_grid_cache_bytes)
+
+		if self.mouse_executor is not None:
+			mice_drawn = self.mouse_executor.map(draw_tiles, tiles_of_each_mouse.values())
+		else:
+			mice_drawn = map(draw_tiles, tiles_of_each_mouse.values())
+
+		for _ in mice_drawn:
+			with self.progress_lock:
+				self.number_of_mice_rendered += 1
+				number_of_mice_rendered = self.number_of_mice_rendered
+			status(f"Processing mouse canvases: {number_of_mice_rendered}/{len(self.settings['mouse_info_dic'])}")
+
+
+	def find_retina_bounds_of_tiles(self, tiles_of_each_mouse):
+		"""
+		Find the retina bounds of every OCT tile that will be cropped, all at once on a pool of processes
+		(or from RetinaBoundsCache), rather than one by one while the tiles are drawn.
+		"""
+		image_paths = []
+		frames = {}
+		for tile_elements in tiles_of_each_mouse.values():
+			for element in tile_elements:
+				operations = {operation["op"]: operation for operation in element.operations}
+				if "open" not in operations or "crop_oct" not in operations:
+					continue
+				image_path = operations["open"]["path"]
+				if operations["open"]["size"][1] != operations["crop_oct"]["height"] and image_path not in self.retina_bounds:
+					image_paths.append(image_path)
+					frames[image_path] = operations["open"].get("frame", 0)
+		if image_paths:
+			self.retina_bounds.update(
+				find_retina_bounds_of_files(image_paths, int(self.settings.get('retina_column_step', 1)), frames)
+			)
+
+
+	def paginate_layout(self):
+		"""
+		Split the document into pages without cutting through a mouse, and lay out each page.
+		settings['pagination']: "group" (one page per group, or more if it is too tall), a number of mouse rows per page, or None
+		(one page, unless the document is too big for a JPEG). Returns a list of (elements, size) layouts.
+		"""
+		pagination = self.settings.get('pagination')
+		sections = self.layout_sections()
+		number_of_columns = int(self.settings['number_of_columns'])
+		row_margin_size = int(self.settings['row_margin_size'])
+		outer_margin_size = int(self.settings['outer_margin_size'])
+
+		# The pages are split on heights measured once (text only, no image is opened), with the same arithmetic
+		# as layout_master_canvas: the title and subtitle above the first group, each group heading and a row of mice
+		LayoutElement = self.LayoutElement
+		_, mouse_height = self.mouse_canvas_size()
+		title_element = LayoutElement.from_text(self.settings['document_title'], self.settings['title_font'], (outer_margin_size, outer_margin_size))
+		first_group_tops = {}		# Without and with the page number in the subtitle (its brackets can make it taller)
+		for page_number_text in ("", " (page 10 of 10)"):
+			subtitle_element = LayoutElement.from_text(self.settings['subtitle'] + page_number_text, self.settings['subtitle_font'], (0, 0))
+			first_group_tops[page_number_text] = title_element.bottom + (title_element.height//5) + subtitle_element.height + row_margin_size
+		group_heading_heights = {
+			group: self.measure_text(self.settings['group_font'], group)[1] + int(row_margin_size / 2)
+			for group, _ in sections if group is not None
+		}
+
+		def page_height(page_sections, page_number_text=" (page 10 of 10)"):
+			y_offset = first_group_tops[page_number_text]
+			bottom_pixel = y_offset
+			for group, group_mice_list in page_sections:
+				y_offset += group_heading_heights.get(group, 0)
+				number_of_mouse_rows = -(-len(group_mice_list) // number_of_columns)
+				bottom_pixel = y_offset + number_of_mouse_rows * (mouse_height + row_margin_size) - row_margin_size
+				y_offset = bottom_pixel + (row_margin_size * 2)
+			return bottom_pixel + outer_margin_size
+
+		if not pagination and page_height(sections, "") <= jpeg_size_limit:
+			pages = [sections]
+		else:
+			# Filling the pages row by row: one group per page ("group") or up to rows_per_page rows, and never more rows
+			# than fit in a JPEG, so a tall group is split between rows of mice (and gets its heading again on the next page)
+			rows_per_page = int(pagination) if pagination and pagination != "group" else None
+			pages = [[]]
+			rows_on_page = 0
+			for group, group_mice_list in sections:
+				for first_mouse in range(0, len(group_mice_list), number_of_columns):
+					row = group_mice_list[first_mouse:first_mouse + number_of_columns]
+					page = pages[-1]
+					if page and page[-1][0] == group:
+						page_with_row = page[:-1] + [(group, page[-1][1] + row)]
+					else:
+						page_with_row = page + [(group, row)]
+					next_group = pagination == "group" and page and page[-1][0] != group
+					if page and (next_group or rows_on_page == rows_per_page or page_height(page_with_row) > jpeg_size_limit):
+						pages.append([(group, row)])
+						rows_on_page = 1
+					else:
+						pages[-1] = page_with_row
+						rows_on_page += 1
+
+		# Laying out each page (same title on every page, and the image type labels are on every row)
+		page_layouts = []
+		for page_number, page_sections in enumerate(pages, start=1):
+			subtitle = self.settings['subtitle']
+			if len(pages) > 1:
+				subtitle = f"{subtitle} (page {page_number} of {len(pages)})".strip()
+			elements, size = self.layout_master_canvas(page_sections, subtitle)
+			if max(size) > jpeg_size_limit:
+				raise ValueError(f"Page {page_number} is {size[0]}x{size[1]} pixels, which is too big for a JPEG "
+								 f"(use fewer columns)")
+			page_layouts.append((elements, size))
+		return page_layouts
+
+	def write_pages(self, page_layouts):
+		"""Render and save each page, named like file_name_page01.jpg"""
+		base_path, extension = os.path.splitext(self.settings['final_product_file_path'])
+		page_file_paths = [f"{base_path}_page{page_number:02d}{extension}" for page_number in range(1, len(page_layouts) + 1)]
+
+		def render_page(page_layout, page_file_path):
+			elements, size = page_layout
+			page_canvas = Image.new('RGB', size, self.settings['background_color'])
+			self.draw_layout_elements(page_canvas, elements)
+			page_canvas.save(page_file_path)
+
+		# One page at a time unless page_workers is set, and never more pages at once than fit in page_memory_mb
+		# (each page's whole canvas is in memory while it is drawn, and a page can be 65535 pixels tall)
+		largest_page_bytes = max(width * height * 3 for _, (width, height) in page_layouts)
+		page_memory_bytes = int(self.settings.get('page_memory_mb', 4096)) * 1024 * 1024
+		page_workers = int(self.settings.get('page_workers', 1) or 1)
+		page_workers = max(min(page_workers, page_memory_bytes // largest_page_bytes, len(page_layouts)), 1)
+
+		self.number_of_mice_rendered = 0
+		with self.rendering_threads(), ThreadPoolExecutor(max_workers=page_workers) as page_executor:
+			list(page_executor.map(render_page, page_layouts, page_file_paths))
+
+		status(f"{len(page_file_paths)} pages saved")
+		return page_file_paths
+
+	def create_master_canvas(self, page_layout=None):
+		"""Lay out (unless page_layout is given) and render the whole compilation document in memory (self.master_canvas)."""
+		if page_layout is None:
+			page_layout = self.layout_master_canvas()
+		self.master_canvas_elements, self.master_canvas_size = page_layout
+
+		# Creating the master canvas
+		self.master_canvas = Image.new('RGB', self.master_canvas_size, self.settings['background_color'])
 
 		# Pasting the elements onto the canvas
-		i = 1
-		number_of_elements = len(self.master_canvas_elements)
-		for element in self.master_canvas_elements:
-			element.draw_on_canvas(self.master_canvas)
-			status(f"Inserting canvas elements: {i}/{number_of_elements}")
-			i += 1
+		self.number_of_mice_rendered = 0
+		with self.rendering_threads():
+			self.draw_layout_elements(self.master_canvas, self.master_canvas_elements)
 
 		status("Canvas creation complete")
 
 
+	def write_master_canvas_in_strips(self, writer_class, file_path):
+		"""
+		Render the compilation document one horizontal strip at a time and hand each strip straight to a
+		StreamingPngWriter or DeepZoomWriter. A strip is a band of rows covered by elements (e.g. one row of mice
+		with its image type labels), so only one strip is ever in memory and peak memory stays the same however many mice there are.
+		"""
+		self.layout_master_canvas()
+		master_width, master_height = self.master_canvas_size
+		background_color = self.settings['background_color']
+
+		# Grouping the elements into strips, so that no element is split between two strips
+		strips = []		# [top, bottom, elements]
+		for element in sorted(self.master_canvas_elements, key=lambda element: element.top):
+			if strips and element.top < strips[-1][1]:
+				strips[-1][1] = max(strips[-1][1], element.bottom)
+				strips[-1][2].append(element)
+			else:
+				strips.append([element.top, element.bottom, [element]])
+
+		writer = writer_class(file_path, master_width, master_height)
+		try:
+			self.number_of_mice_rendered = 0
+			rows_written = 0
+			with self.rendering_threads():
+				for top, bottom, strip_elements in strips:
+					# Margin between strips
+					writer.write_blank_rows(top - rows_written, background_color)
+
+					strip = Image.new('RGB', (master_width, bottom - top), background_color)
+					self.draw_layout_elements(strip, strip_elements, origin=(0, top))
+					writer.write_rows(strip)
+					rows_written = bottom
+
+			writer.write_blank_rows(master_height - rows_written, background_color)
+		finally:
+			writer.close()
+
+		status("Compilation document written")
+		return writer
+
+
 	# ====================================================
 	# SAVE & DISPLAY
 	# ====================================================
@@ -2455,6 +5052,13 @@ class ImageCompilation:
 		
 		final_product_file_path = self.settings['final_product_file_path']
 		self.master_canvas.save(final_product_file_path)
+		self.saved_file_path = final_product_file_path
+		self.open_compilation_document(final_product_file_path)
+
+	def open_compilation_document(self, final_product_file_path):
+		# Batch mode only saves, the next study can start right away
+		if self.headless:
+			return
 
 		# Opening the final product
 		if os.name == 'nt':  # Check if the operating system is Windows
@@ -2480,6 +5084,12 @@ class ImageCompilation:
 		# 2. Build image list
 		self.build_mouse_image_list()
 
+		# Let the user choose any [select] images now, so nothing interrupts the rendering
+		self.resolve_image_selections()
+
+		# The "max_signal" frames of OCT volumes are found all at once, before any mouse is laid out
+		self.find_oct_volume_frames(self.layout_sections())
+
 		# 3. Determine size of individual mouse canvas
 		# Initializing individual mouse canvas creation to determine heading size (self.total_heading_height)
 		example_mouse_number = list(self.mouse_image_list.keys())[0]
@@ -2487,7 +5097,41 @@ class ImageCompilation:
 
 		
 		# 4. Create master canvas and layout
-		self.create_master_canvas()
+		# The render plan alone (where every text and image goes, and how each image is cropped/resized) can be saved as JSON,
+		# one plan per page when the document would be split into pages
+		if self.mode == "render_plan":
+			plan_file_paths = self.export_page_render_plans(self.paginate_layout())
+			self.saved_file_path = plan_file_paths[0]
+			return
+
+		# Large studies can be written one strip at a time to a PNG or a deep zoom tile pyramid instead (the master canvas is never in memory)
+		if self.settings.get('deep_zoom') and self.mode == "full":
+			self.reuse_mouse_grids = False
+			writer = self.write_master_canvas_in_strips(DeepZoomWriter, self.settings['final_product_file_path'])
+			self.saved_file_path = writer.html_path
+			self.open_compilation_document(writer.html_path)
+			return
+
+		if self.settings.get('strip_rendering') and self.mode == "full":
+			self.reuse_mouse_grids = False
+			final_product_file_path = os.path.splitext(self.settings['final_product_file_path'])[0] + ".png"
+			self.write_master_canvas_in_strips(StreamingPngWriter, final_product_file_path)
+			self.saved_file_path = final_product_file_path
+			self.open_compilation_document(final_product_file_path)
+			return
+
+		# Documents too big for one JPEG (or when asked to) are split into pages
+		page_layout = None
+		if self.mode == "full":
+			page_layouts = self.paginate_layout()
+			if len(page_layouts) > 1:
+				page_file_paths = self.write_pages(page_layouts)
+				self.saved_file_path = page_file_paths[0]
+				self.open_compilation_document(page_file_paths[0])
+				return
+			page_layout = page_layouts[0]
+
+		self.create_master_canvas(page_layout)
 
 		# Ends before actually saving the document
 		if self.mode == "preview_layout" or self.mode == "preview_layout_and_images":
@@ -2507,6 +5151,85 @@ class ImageCompilation:
 -------------------------------
 """
 
-settings = user_defined_settings()
-compiler = ImageCompilation(settings)
-compiler.run()
+def pages_argument(value):
+	"""argparse type of --pages: "group", or a number of mouse rows per page."""
+	if value == "group":
+		return value
+	try:
+		rows_per_page = int(value)
+	except ValueError:
+		rows_per_page = 0
+	if rows_per_page < 1:
+		raise argparse.ArgumentTypeError(f"expected \"group\" or a number of rows per page, not {value!r}")
+	return rows_per_page
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+		description="Compile in vivo cSLO and OCT images into one document. "
+					"Without any settings files the settings dialog box is opened."
+	)
+	parser.add_argument("settings_files", nargs="*", metavar="SETTINGS_FILE",
+					 help="JSON/YAML settings file(s) to compile without the settings dialog box")
+	parser.add_argument("--workers", type=int, default=None, metavar="N",
+					 help="render N mouse canvases at a time (overrides parallel_workers in the settings)")
+	parser.add_argument("--strips", action="store_true",
+					 help="write a PNG one strip of mice at a time instead of holding the whole document in memory")
+	parser.add_argument("--deep-zoom", action="store_true",
+					 help="write a deep zoom tile pyramid and an HTML page to browse it, instead of one big image")
+	parser.add_argument("--pages", type=pages_argument, default=None, metavar="group|N",
+					 help="split the document into pages: one per group, or N rows of mice per page")
+	parser.add_argument("--export-plan", action="store_true",
+					 help="only save the layout (render plan) as JSON next to the output, without rendering any images")
+	parser.add_argument("--compare-retina-bounds", metavar="OCT_DIRECTORY",
+					 help="check the fast retina bounds against the original implementation on the scans in a directory")
+	parser.add_argument("--column-step", type=int, default=1, metavar="N",
+					 help="with --compare-retina-bounds, only look at every Nth column")
+	args = parser.parse_args(argv)
+
+	if args.compare_retina_bounds:
+		oct_image_paths = DirectoryScan.for_directory(args.compare_retina_bounds, "oct").oct_image_paths
+		differences = compare_retina_bounds(oct_image_paths, args.column_step)
+		sys.exit(1 if differences else 0)
+
+	def apply_command_line_options(settings):
+		if args.workers is not None:
+			settings['parallel_workers'] = args.workers
+		if args.strips:
+			settings['strip_rendering'] = True
+		if args.deep_zoom:
+			settings['deep_zoom'] = True
+		if args.pages is not None:
+			settings['pagination'] = args.pages
+
+	# Dialog box
+	if not args.settings_files:
+		settings = user_defined_settings()
+		apply_command_line_options(settings)
+		compiler = ImageCompilation(settings, mode="render_plan" if args.export_plan else "full")
+		compiler.run()
+		return
+
+	# Batch mode
+	failed_settings_files = []
+	for settings_file in args.settings_files:
+		status(f"Compiling {settings_file}")
+		print()
+		try:
+			settings = load_settings_file(settings_file)
+			apply_command_line_options(settings)
+			compiler = ImageCompilation(settings, mode="render_plan" if args.export_plan else "full", headless=True)
+			compiler.run()
+		except Exception as error:
+			print(f"\n{settings_file} failed: {error!r}")
+			failed_settings_files.append(settings_file)
+			continue
+		print(f"\nSaved {compiler.saved_file_path}")
+
+	if failed_settings_files:
+		sys.exit(f"{len(failed_settings_files)} of {len(args.settings_files)} compilations failed: "
+				 + ", ".join(failed_settings_files))
+
+
+if __name__ == "__main__":
+	main()